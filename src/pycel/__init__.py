@@ -1,3 +1,4 @@
-from .excelcompiler import ExcelCompiler
+from .excelcompiler import CompiledCache, ExcelCompiler
+from .excelformula import FormulaCache
 from .excelutil import AddressCell, AddressRange, PyCelException
 from .version import __version__
@@ -1,28 +1,55 @@
+import array
+import bisect
 import collections
+import concurrent.futures
+import gc
 import hashlib
+import importlib.util
+import io
 import itertools as it
 import json
 import logging
+import marshal
+import mmap
 import os
 import pickle
+import re
+import struct
+import sys
 
 import networkx as nx
-from pycel.excelformula import ExcelFormula
+import numpy as np
+from pycel.excelformula import ExcelFormula, FormulaCache
 from pycel.excelutil import (
     AddressCell,
     AddressRange,
     flatten,
+    LazyRange,
     list_like,
     NULL_ERROR,
+    RangeValues,
     VALUE_ERROR,
 )
-from pycel.excelwrapper import ExcelOpxWrapper
+from pycel.excelwrapper import ExcelOpxWrapper, ExcelXlsxWrapper
+from pycel.version import __version__
 from ruamel.yaml import YAML
 
 REF_START = '=_REF_("'
 REF_END = '")'
 REF_FORMAT = REF_START + '{}' + REF_END
 
+BINARY_MAGIC = b'PYCELBIN'
+BINARY_FORMAT_VERSION = 1
+BINARY_HEADER = struct.Struct('<8sH4sQ')
+
+COMPRESSED_MAGIC = b'PYCELCMP'
+COMPRESSED_FORMAT_VERSION = 1
+COMPRESSED_HEADER = struct.Struct('<8sHQ')
+
+TEMPLATE_START = '=#'
+TEMPLATE_FORMAT_VERSION = 1
+CODE_ADDRESS_RE = re.compile(r'\b(_C_|_R_|_REF_)\("([^"]+)"\)')
+
 
 class ExcelCompiler:
     """Class responsible for taking an Excel spreadsheet and compiling it
@@ -30,20 +57,52 @@ class ExcelCompiler:
     independently of excel.
     """
 
-    save_file_extensions = ('pkl', 'pickle', 'yml', 'yaml', 'json')
+    save_file_extensions = (
+        'pkl', 'pickle', 'yml', 'yaml', 'json', 'bin', 'zmodel')
 
     def __init__(self, filename=None, excel=None, plugins=None,
-                 max_iterations=None):
+                 max_iterations=None, lazy_ranges=False,
+                 use_calc_chain=False, cache=None, formula_cache=None,
+                 lazy_sheets=False, parse_workers=None):
         """ Build a compiler instance to organize the formula for a workbook
 
-        :param filename: Excel filename to load from (xlsx or `to_file`)
+        :param filename: Excel filename to load from (xlsx or `to_file`),
+            or an xlsx as bytes or a binary file object
         :param excel: Opened instance of ExcelWrapper
         :param plugins: module paths for plugin lib functions
         :param max_iterations maximum number of formula iterations allows
             for formula with circular references
+        :param lazy_ranges: pass ranges to functions which support it
+            (INDEX, MATCH, VLOOKUP...) as a `LazyRange` which only evaluates
+            the cells which are accessed.
+        :param use_calc_chain: if the workbook's calc chain (the order Excel
+            last calculated the formulas in) is consistent with the dependency
+            graph, `recalculate` evaluates in that order.
+        :param cache: a `CompiledCache`, or a directory for one.  If this
+            workbook (same contents, pycel version and options) is in the
+            cache, the compiler is loaded from there instead of the xlsx.
+            The workbook is then only read if cells not in the cached model
+            are needed.  The entry is written as cells are built, each time
+            the model has doubled in size since it was last written, and
+            `save_to_cache` writes the cells built since.  Not used with
+            `excel`.
+        :param formula_cache: a `FormulaCache`, or a filename for one, to
+            share formula translations with other workbooks.
+        :param lazy_sheets: read the workbook with `ExcelXlsxWrapper`,
+            parsing each worksheet the first time it is used.  Not used
+            with `excel`.
+        :param parse_workers: read the workbook with `ExcelXlsxWrapper`,
+            parsing the worksheets in a pool of this many processes.  Not
+            used with `excel`.
         """
 
         self._eval = None
+        self._cache_key = None
+
+        if formula_cache is not None and not isinstance(
+                formula_cache, FormulaCache):
+            formula_cache = FormulaCache(formula_cache)
+        self.formula_cache = formula_cache
 
         if excel:
             # if we are running as an excel addin, this gets passed to us
@@ -53,9 +112,36 @@ class ExcelCompiler:
         else:
             # TODO: use a proper interface so we can (eventually) support
             # loading from file (much faster)  Still need to find a good lib.
-            self.excel = ExcelOpxWrapper(filename=filename)
+            if lazy_sheets or parse_workers:
+                self.excel = ExcelXlsxWrapper(
+                    filename, lazy_sheets=lazy_sheets,
+                    parse_workers=parse_workers)
+            else:
+                self.excel = ExcelOpxWrapper(filename=filename)
+            self.filename = filename if isinstance(
+                filename, str) else self.excel.filename
+
+            if cache is not None:
+                if not isinstance(cache, CompiledCache):
+                    cache = CompiledCache(cache)
+                cache_key = cache.key(
+                    self._compute_excel_file_md5_digest, plugins=plugins,
+                    max_iterations=max_iterations, lazy_ranges=lazy_ranges,
+                    use_calc_chain=use_calc_chain)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    cached.excel = self.excel
+                    cached.filename = self.filename
+                    cached.formula_cache = formula_cache
+                    self.__dict__.update(cached.__dict__)
+                    self.cache, self._cache_key = cache, cache_key
+
+                    # the workbook is connected if cells need to be built
+                    self._excel_connected = False
+                    return
+
             self.excel.connect()
-            self.filename = filename
+        self._excel_connected = True
 
         # grab a copy of the current hash
         self._excel_file_md5_digest = self._compute_excel_file_md5_digest
@@ -74,27 +160,74 @@ class ExcelCompiler:
 
         self.extra_data = None
         self._formula_cells_dict = {}
+
+        # parsed master formulas of shared formulas, by master address
+        self._shared_formulas = {}
         self._plugin_modules = plugins
 
+        # the values before being changed, since `snapshot_values`
+        self._saved_values = None
+
         # max iteration configuration for evaluating formulas with
         # circular references
         self._max_iterations = max_iterations
 
+        self.lazy_ranges = lazy_ranges
+
+        self.use_calc_chain = use_calc_chain
+        self._calc_chain = None
+
+        # the cache entry is written as the model grows, see `_grow_cache`
+        self.cache = None
+        self._cached_size = 0
+        if cache is not None and excel is None:
+            self.cache, self._cache_key = cache, cache_key
+
     def __getstate__(self):
         # code objects are not serializable
         state = dict(self.__dict__)
-        for to_remove in '_eval excel log graph_todos range_todos'.split():
+        for to_remove in ('_eval excel log graph_todos range_todos '
+                          '_shared_formulas _calc_chain cache '
+                          'formula_cache _saved_values '
+                          '_excel_connected').split():
             if to_remove in state:    # pragma: no branch
                 state[to_remove] = None
         return state
 
     def __setstate__(self, d):
         self.__dict__.update(d)
+        self.graph_todos = self.graph_todos or []
+        self.range_todos = self.range_todos or []
+        if self.__dict__.get('_shared_formulas') is None:
+            self._shared_formulas = {}
+        self.formula_cache = self.__dict__.get('formula_cache')
+        self._saved_values = self.__dict__.get('_saved_values')
+        self._cached_size = self.__dict__.get('_cached_size', 0)
+        self._excel_connected = True
         self.log = logging.getLogger('pycel')
 
+    def _connect_excel(self):
+        """Connect the workbook of a compiler loaded from the cache"""
+        if not self._excel_connected:
+            self._excel_connected = True
+            self.excel.connect()
+
+    def save_to_cache(self):
+        """Store the compiler, with the cells compiled so far, in the cache"""
+        if self._cache_key is None:
+            raise ValueError('Compiler was not loaded with a cache')
+        self._cached_size = len(self.cell_map)
+        self.cache.put(self._cache_key, self)
+
+    def _grow_cache(self):
+        """Rewrite the cache entry if the model has doubled in size"""
+        if self.cache is not None and \
+                len(self.cell_map) > 2 * self._cached_size:
+            self.save_to_cache()
+
     @staticmethod
     def _compute_file_md5_digest(filename):
-        if not os.path.exists(filename):
+        if not filename or not os.path.exists(filename):
             return None
         else:
             hash_md5 = hashlib.md5()
@@ -105,6 +238,9 @@ class ExcelCompiler:
 
     @property
     def _compute_excel_file_md5_digest(self):
+        contents = getattr(self.excel, 'contents', None)
+        if contents is not None:
+            return hashlib.md5(contents).hexdigest()
         return self._compute_file_md5_digest(self.filename)
 
     @property
@@ -117,7 +253,9 @@ class ExcelCompiler:
         if self._eval is None:
             self._eval = ExcelFormula.build_eval_context(
                 self._evaluate, self._evaluate_range,
-                self.log, plugins=self._plugin_modules)
+                self.log, plugins=self._plugin_modules,
+                evaluate_lazy_range=(
+                    self._evaluate_lazy_range if self.lazy_ranges else None))
         return self._eval
 
     @classmethod
@@ -125,26 +263,82 @@ class ExcelCompiler:
         return next((extension for extension in cls.save_file_extensions
                      if filename.endswith(extension)), None)
 
-    def _to_text(self, filename=None, is_json=False):
-        """Serialize to a json/yaml file"""
-        extra_data = {} if self.extra_data is None else self.extra_data
+    def _default_filename(self, extension=''):
+        """The workbook filename plus an extension, to save files next to"""
+        if self.filename is None:
+            raise ValueError('A filename is needed, the workbook was not '
+                             'loaded from a file')
+        return self.filename + extension
 
+    def _serialized_cell_values(self):
+        """The address and value (or `=python_code`) of each saved cell"""
         def cell_value(a_cell):
             if a_cell.formula and a_cell.formula.python_code:
                 return '=' + a_cell.formula.python_code
             else:
                 return a_cell.value
 
+        return sorted(
+            ((addr, cell_value(cell))
+             for addr, cell in self.cell_map.items() if cell.serialize),
+            key=lambda x: AddressRange(x[0]).sort_key
+        )
+
+    def _evaluated_values(self):
+        """ The values of the evaluated formula cells and ranges
+
+        numpy scalars (SUMPRODUCT, etc.) are stored as python numbers.
+        Values the text formats can not store are left out, and so are
+        evaluated again when the model is loaded.
+        """
+        def plain(value):
+            return value.item() if isinstance(value, np.generic) else value
+
+        def storable(value):
+            return value is None or isinstance(value, (bool, int, float, str))
+
+        values = {}
+        for addr, cell in self.cell_map.items():
+            if isinstance(cell, _CellRange):
+                if list_like(cell.value):
+                    rows = [[plain(v) for v in row] for row in cell.value]
+                    if all(map(storable, it.chain.from_iterable(rows))):
+                        values[addr] = rows
+            elif cell.formula and cell.value is not None:
+                value = plain(cell.value)
+                if storable(value):
+                    values[addr] = value
+        return dict(sorted(
+            values.items(), key=lambda x: AddressRange(x[0]).sort_key))
+
+    def _to_text(self, filename=None, is_json=False, templates=False,
+                 snapshot=False):
+        """ Serialize to a json/yaml file
+
+        :param templates: store the formulas which are copies of each other
+            once, as templates, see `_formula_templates`
+        :param snapshot: store the values of the evaluated formula cells
+            and ranges, with a fingerprint of the model they came from
+        """
+        extra_data = {} if self.extra_data is None else self.extra_data
+
+        cell_values = self._serialized_cell_values()
+        if templates:
+            cell_values, formula_templates = _formula_templates(cell_values)
+            extra_data['template_format_version'] = TEMPLATE_FORMAT_VERSION
+            extra_data['formula_templates'] = formula_templates
+
         extra_data.update(dict(
             excel_hash=self._excel_file_md5_digest,
-            cell_map=dict(sorted(
-                ((addr, cell_value(cell))
-                 for addr, cell in self.cell_map.items() if cell.serialize),
-                key=lambda x: AddressRange(x[0]).sort_key
-            )),
+            cell_map=dict(cell_values),
         ))
+        if snapshot:
+            extra_data['snapshot'] = dict(
+                fingerprint=_model_fingerprint(extra_data),
+                values=self._evaluated_values(),
+            )
         if not filename:
-            filename = self.filename + ('.json' if is_json else '.yml')
+            filename = self._default_filename('.json' if is_json else '.yml')
 
         # hash the current file to see if this function makes any changes
         existing_hash = (self._compute_file_md5_digest(filename)
@@ -160,6 +354,9 @@ class ExcelCompiler:
                 json.dump(extra_data, f, indent=4)
 
         del extra_data['cell_map']
+        extra_data.pop('template_format_version', None)
+        extra_data.pop('formula_templates', None)
+        extra_data.pop('snapshot', None)
 
         # hash the newfile, return True if it changed, this is only reliable
         # on pythons which have ordered dict (CPython 3.6 & python 3.7+)
@@ -167,8 +364,14 @@ class ExcelCompiler:
                 existing_hash != self._compute_file_md5_digest(filename))
 
     @classmethod
-    def _from_text(cls, filename, is_json=False):
-        """deserialize from a json/yaml file"""
+    def _from_text(cls, filename, is_json=False, lazy=False,
+                   line_numbers=True):
+        """ deserialize from a json/yaml file
+
+        :param lazy: keep the file's cells, and build them as they are used
+        :param line_numbers: use the (much slower) round trip yaml loader,
+            which provides the line numbers of the formulas for tracebacks
+        """
 
         if not is_json:
             if not filename.split('.')[-1].startswith('y'):
@@ -178,51 +381,314 @@ class ExcelCompiler:
                 filename += '.json'
 
         with open(filename, 'r') as f:
-            data = YAML().load(f)
+            if line_numbers:
+                data = YAML().load(f)
+            elif is_json:
+                data = json.load(f)
+            else:
+                data = YAML(typ='safe').load(f)
 
-        excel = _CompiledImporter(filename, data)
-        excel_compiler = cls(excel=excel)
-        excel.compiler = excel_compiler
+        version = data.pop('template_format_version', None)
+        if 'formula_templates' in data and version != TEMPLATE_FORMAT_VERSION:
+            raise ValueError("Unsupported template format {}: '{}'".format(
+                version, filename))
 
-        def add_line_numbers(cell_addr, line_number):
-            formula = excel_compiler.cell_map[cell_addr].formula
-            if formula is not None:
-                formula.lineno = line_number
-                formula.filename = filename
-
-        # populate the cells
-        range_todos = []
-        for address, python_code in data['cell_map'].items():
-            lineno = data['cell_map'].lc.data[address][0] + 1
-            address = AddressRange(address)
-            if address.is_range:
-                range_todos.append((address, lineno))
+        excel = _CompiledImporter(filename, data)
+        snapshot = data.pop('snapshot', None)
+        if snapshot is not None:
+            if snapshot['fingerprint'] == _model_fingerprint(data):
+                excel.snapshot = snapshot['values']
             else:
-                excel_compiler._make_cells(address)
-                add_line_numbers(address.address, lineno)
-
-        # populate the ranges and dependant graph
-        for address, lineno in range_todos:
-            excel_compiler._make_cells(address)
-            add_line_numbers(address.address, lineno)
+                logging.getLogger('pycel').warning(
+                    "Snapshot does not match the model, not used: '{}'"
+                    .format(filename))
 
-        excel_compiler._process_gen_graph()
+        excel_compiler = cls._from_importer(excel, data['cell_map'], lazy)
         del data['cell_map']
+        data.pop('formula_templates', None)
 
         # process the rest of the data from the file
         excel_compiler._excel_file_md5_digest = data['excel_hash']
         del data['excel_hash']
         excel_compiler.extra_data = data
 
-        # remove "excel" file references for GC
+        if not lazy:
+            # remove "excel" file references for GC
+            excel_compiler.excel = None
+        return excel_compiler
+
+    @classmethod
+    def _from_importer(cls, excel, addresses, lazy):
+        """ Build a compiler reading from a `_CompiledImporter`
+
+        :param addresses: the addresses of all the cells in the file
+        :param lazy: do not build the cells, they are built when needed
+        """
+        excel_compiler = cls(excel=excel)
+        excel.compiler = excel_compiler
+
+        if not lazy:
+            # populate the cells
+            range_todos = []
+            for address in addresses:
+                address = AddressRange(address)
+                if address.is_range:
+                    range_todos.append(address)
+                else:
+                    excel_compiler._make_cells(address)
+
+            # populate the ranges and dependant graph
+            for address in range_todos:
+                excel_compiler._make_cells(address)
+
+            # ranges with a snapshot value do not need to be evaluated
+            for address, value in excel.snapshot.items():
+                if list_like(value):
+                    if address not in excel_compiler.cell_map:
+                        excel_compiler._make_cells(AddressRange(address))
+                    excel_compiler.cell_map[address].value = RangeValues(
+                        map(tuple, value))
+
+            excel_compiler._process_gen_graph()
+        return excel_compiler
+
+    def _to_compressed(self, filename, compression='zlib'):
+        """ Serialize to the compressed format
+
+        After the header (magic, format version and the size of the
+        metadata) is the marshalled metadata, with the table of contents,
+        then a section for each sheet.  The sections are the marshalled
+        cells of the sheet, as in the text formats, compressed separately
+        so they can be decompressed independently, and only when needed.
+        Values which marshal can not store (datetimes, custom classes in
+        `extra_data`, etc.) are pickled instead, see `_dumps`.
+
+        :param compression: 'zlib' or 'lzma'
+        """
+        compress = _compressor(compression).compress
+        sheets = collections.OrderedDict()
+        for addr, value in self._serialized_cell_values():
+            sheets.setdefault(addr.rsplit('!', 1)[0], []).append(
+                (addr, value))
+
+        table, data, position = {}, [], 0
+        for sheet, cell_values in sheets.items():
+            section = compress(_dumps(dict(cell_values)))
+            table[sheet] = position, len(section)
+            data.append(section)
+            position += len(section)
+
+        meta = _dumps(dict(
+            compression=compression,
+            sections=table,
+            excel_hash=self._excel_file_md5_digest,
+            extra_data=self.extra_data,
+        ))
+        with open(filename, 'wb') as f:
+            f.write(COMPRESSED_HEADER.pack(
+                COMPRESSED_MAGIC, COMPRESSED_FORMAT_VERSION, len(meta)))
+            f.write(meta)
+            for section in data:
+                f.write(section)
+
+    @classmethod
+    def _from_compressed(cls, filename, lazy=False):
+        """ deserialize from the compressed format
+
+        :param lazy: decompress the sheets as their cells are needed,
+            otherwise they are all decompressed in parallel threads
+        """
+        with open(filename, 'rb') as f:
+            cell_map = _CompressedCellMap(f.read(), filename)
+
+        if not lazy:
+            cell_map.decompress_all()
+
+        excel_compiler = cls._from_importer(
+            _CompiledImporter(filename, dict(cell_map=cell_map)),
+            cell_map, lazy)
+        excel_compiler._excel_file_md5_digest = cell_map.excel_hash
+        excel_compiler.extra_data = cell_map.extra_data
+
+        if not lazy:
+            # remove "excel" file references for GC
+            excel_compiler.excel = None
+        return excel_compiler
+
+    def _to_binary(self, filename):
+        """Serialize to the binary format, see `_write_binary`"""
+        with open(filename, 'wb') as f:
+            self._write_binary(f)
+
+    def _write_binary(self, f, with_code=True):
+        """ Write the model in the binary format
+
+        After the header (magic, format version, python bytecode magic and
+        the size of the metadata) is the marshalled metadata, then sections
+        of little endian arrays and blobs, aligned to 8 bytes, which are
+        used in place when loaded (see `_BinaryModel`):
+
+            string table, as utf-8 with the offsets of each string
+            cell addresses (sorted, so cells can be found by bisection)
+            python code of each cell (or -1 for values and -2 for ranges)
+            the values (see `_dumps`) and compiled code of each cell
+            the dependency graph as predecessor and successor adjacency
+
+        :param f: binary file object to write to
+        :param with_code: include the marshalled code, compiling as needed
+        """
+        strings = {}
+
+        def intern(string):
+            return strings.setdefault(string, len(strings))
+
+        def offsets(lengths):
+            return it.chain((0, ), it.accumulate(lengths))
+
+        cells = sorted(self.cell_map.values(), key=lambda c: c.address.address)
+        index = {cell: i for i, cell in enumerate(cells)}
+
+        python_codes, values, codes, names = [], [], [], []
+        for cell in cells:
+            code, code_names = b'', None
+            if isinstance(cell, _CellRange):
+                python_codes.append(_BinaryModel.RANGE)
+                values.append(_dumps(None))
+            elif cell.python_code:
+                python_codes.append(intern(cell.python_code))
+                values.append(_dumps(None))
+                if with_code:
+                    code, code_names = cell.formula.marshalled_python or (
+                        b'', None)
+            else:
+                python_codes.append(_BinaryModel.VALUE)
+                values.append(_dumps(cell.value))
+            codes.append(code)
+            names.append(-1 if code_names is None else
+                         intern(' '.join(sorted(code_names))))
+
+        # skip cells removed, or formulas trimmed, by `trim_graph`
+        preds = [[] for cell in cells]
+        succs = [[] for cell in cells]
+        for src, dest in self.dep_graph.edges():
+            if src in index and dest in index and (
+                    isinstance(dest, _CellRange) or dest.formula):
+                preds[index[dest]].append(index[src])
+                succs[index[src]].append(index[dest])
+
+        addresses = [intern(cell.address.address) for cell in cells]
+        encoded = [string.encode() for string in strings]
+        sections = (
+            ('string_offsets', 'q', offsets(map(len, encoded))),
+            ('strings', None, b''.join(encoded)),
+            ('addresses', 'i', addresses),
+            ('python_codes', 'i', python_codes),
+            ('value_offsets', 'q', offsets(map(len, values))),
+            ('values', None, b''.join(values)),
+            ('code_offsets', 'q', offsets(map(len, codes))),
+            ('codes', None, b''.join(codes)),
+            ('names', 'i', names),
+            ('nodes', 'i', (index[node] for node in self.dep_graph
+                            if node in index)),
+            ('pred_offsets', 'q', offsets(map(len, preds))),
+            ('preds', 'i', it.chain.from_iterable(preds)),
+            ('succ_offsets', 'q', offsets(map(len, succs))),
+            ('succs', 'i', it.chain.from_iterable(succs)),
+        )
+
+        table, data, position = {}, [], 0
+        for name, typecode, section in sections:
+            if typecode is not None:
+                section = array.array(typecode, section)
+                if sys.byteorder != 'little':  # pragma: no cover
+                    section.byteswap()
+                section = section.tobytes()
+            table[name] = position, len(section), typecode
+            padding = -len(section) % 8
+            data.extend((section, bytes(padding)))
+            position += len(section) + padding
+
+        meta = _dumps(dict(
+            sections=table,
+            excel_hash=self._excel_file_md5_digest,
+            extra_data=self.extra_data,
+        ))
+        f.write(BINARY_HEADER.pack(
+            BINARY_MAGIC, BINARY_FORMAT_VERSION,
+            importlib.util.MAGIC_NUMBER, len(meta)))
+        f.write(meta)
+        f.write(bytes(-(BINARY_HEADER.size + len(meta)) % 8))
+        for section in data:
+            f.write(section)
+
+    @classmethod
+    def _from_binary(cls, filename, use_mmap=False, lazy=False):
+        """deserialize from the binary format"""
+        with open(filename, 'rb') as f:
+            if use_mmap:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = f.read()
+        model = _BinaryModel(buffer, filename)
+
+        if not (use_mmap or lazy):
+            return cls._from_binary_model(filename, model)
+
+        excel_compiler = cls(
+            excel=_CompiledImporter(filename, dict(cell_map={})))
+        excel_compiler.excel = None
+        excel_compiler.cell_map = _MappedCellMap(
+            model, excel_compiler.dep_graph)
+        excel_compiler._excel_file_md5_digest = model.excel_hash
+        excel_compiler.extra_data = model.extra_data
+        return excel_compiler
+
+    @classmethod
+    def _from_binary_model(cls, filename, model):
+        """Build a compiler from all the cells of a `_BinaryModel`"""
+        excel_compiler = cls(
+            excel=_CompiledImporter(filename, dict(cell_map={})))
         excel_compiler.excel = None
+
+        # creating many objects at once triggers needless garbage collection
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            cells = [model.build_cell(i) for i in range(model.size)]
+            excel_compiler.cell_map.update(
+                (cell.address.address, cell) for cell in cells)
+
+            # populate the dependant graph
+            excel_compiler.dep_graph.add_nodes_from(
+                (cell, _graph_node_attributes(cell))
+                for cell in map(cells.__getitem__, model.nodes))
+            excel_compiler.dep_graph.add_edges_from(
+                (cells[pred], cell) for i, cell in enumerate(cells)
+                for pred in model.predecessors(i))
+        finally:
+            if gc_enabled:  # pragma: no branch
+                gc.enable()
+
+        excel_compiler._excel_file_md5_digest = model.excel_hash
+        excel_compiler.extra_data = model.extra_data
         return excel_compiler
 
-    def to_file(self, filename=None, file_types=('pkl', 'yml')):
+    def to_file(self, filename=None, file_types=('pkl', 'yml'),
+                templates=False, compression='zlib', snapshot=False):
         """ Save the spreadsheet to a file so it can be loaded later w/o excel
 
         :param filename: filename to save as, defaults to xlsx_name + file_type
-        :param file_types: one or more of: pkl, pickle, yml, yaml, json
+            (needed for a workbook loaded from bytes or a file object)
+        :param file_types: one or more of: pkl, pickle, yml, yaml, json, bin,
+            zmodel
+        :param templates: in the text file formats, store formulas which
+            are copied down or across once, as a template with relative
+            (R1C1) addresses, and only the template id for each cell
+        :param compression: for the compressed format, 'zlib' or 'lzma'
+        :param snapshot: in the text file formats, also store the values of
+            the evaluated formula cells and ranges.  They are used by
+            `from_file`, if the cells are unchanged, so the loaded model
+            does not evaluate them again.
 
         If the filename has one of the expected extensions, then this
         parameter is ignored.
@@ -237,9 +703,19 @@ class ExcelCompiler:
         The pickle file format provides the benefits of:
             1. Much faster to load (5x to 10x)
             2. ...  (no #2, speed is the thing)
+
+        The binary file format (bin) is faster again to load, and smaller.
+        It includes the dependency graph and the compiled formulas, so the
+        loaded compiler is ready to evaluate without any parsing.  With
+        `from_file(..., use_mmap=True)` it is used in place, and shared by
+        the processes loading it.
+
+        The compressed file format (zmodel) is the smallest, for storing
+        and transferring models.  Each sheet is compressed separately, and
+        `from_file(..., lazy=True)` decompresses only the sheets needed.
         """
 
-        filename = filename or self.filename
+        filename = filename or self._default_filename()
         extension = self._filename_has_extension(filename)
         if extension:
             file_types = (extension, )
@@ -252,44 +728,82 @@ class ExcelCompiler:
             raise ValueError('Unknown file types: {}'.format(
                 ' '.join(unknown_types)))
 
+        binary_extensions = tuple(
+            ft for ft in ('bin', 'zmodel') if ft in file_types)
         pickle_extension = next((ft for ft in file_types
                                  if ft.startswith('p')), None)
         non_pickle_extension = next((ft for ft in file_types
-                                     if not ft.startswith('p')), None)
+                                     if not ft.startswith('p') and
+                                     ft not in binary_extensions), None)
         extra_extensions = tuple(ft for ft in file_types if ft not in (
-            pickle_extension, non_pickle_extension))
+            pickle_extension, non_pickle_extension) + binary_extensions)
 
         if extra_extensions:
             raise ValueError(
                 'Only allowed one pickle extension and one text extension. '
                 'Extras: {}'.format(extra_extensions))
 
-        is_json = non_pickle_extension and non_pickle_extension[0] == 'j'
+        for binary_extension in binary_extensions:
+            binary_name = filename
+            if not binary_name.endswith(binary_extension):
+                binary_name += '.' + binary_extension
+            if binary_extension == 'bin':
+                self._to_binary(binary_name)
+            else:
+                self._to_compressed(binary_name, compression=compression)
 
-        # round trip through yaml/json to strip out junk
+        if pickle_extension and not filename.endswith(pickle_extension):
+            pickle_name = filename + '.' + pickle_extension
+        else:
+            pickle_name = filename
+
+        if not non_pickle_extension:
+            if pickle_extension:
+                # no text file is wanted, so build the stripped down
+                # compiler directly instead of round tripping through yaml
+                data = io.BytesIO()
+                self._write_binary(data, with_code=False)
+                excel_compiler = self._from_binary_model(
+                    pickle_name, _BinaryModel(data.getbuffer(), pickle_name))
+                if excel_compiler.extra_data is None:
+                    # as loaded from a text file
+                    excel_compiler.extra_data = {}
+                with open(pickle_name, 'wb') as f:
+                    pickle.dump(excel_compiler, f)
+            return
+
+        is_json = non_pickle_extension[0] == 'j'
+
+        # the pickle is round tripped through the text file, so that the
+        # formulas have line numbers in the text file
         text_name = filename
-        if not text_name.endswith(non_pickle_extension or '.yml'):
-            text_name += '.' + (non_pickle_extension or 'yml')
-        text_changed = self._to_text(text_name, is_json=is_json)
+        if not text_name.endswith(non_pickle_extension):
+            text_name += '.' + non_pickle_extension
+        text_changed = self._to_text(text_name, is_json=is_json,
+                                     templates=templates, snapshot=snapshot)
 
         # save pickle file if requested and has changed
         if pickle_extension:
-            if not filename.endswith(pickle_extension):
-                filename += '.' + pickle_extension
-
-            if text_changed or not os.path.exists(filename):
+            if text_changed or not os.path.exists(pickle_name):
                 excel_compiler = self._from_text(text_name, is_json=is_json)
-                if non_pickle_extension not in file_types:
-                    os.unlink(text_name)
-
-                with open(filename, 'wb') as f:
+                with open(pickle_name, 'wb') as f:
                     pickle.dump(excel_compiler, f)
 
     @classmethod
-    def from_file(cls, filename):
+    def from_file(cls, filename, use_mmap=False, lazy=False,
+                  line_numbers=True):
         """ Load the spreadsheet saved by `to_file`
 
         :param filename: filename to load from, can be xlsx_name
+        :param use_mmap: for the binary format, map the file read only and
+            build cells only as they are used.  Processes mapping the same
+            file share one copy of it in the page cache.
+        :param lazy: for the text, binary and compressed formats, only read
+            the file, and build the cells, formulas and graph edges as
+            `evaluate` reaches them.  `to_file` only saves the cells built.
+        :param line_numbers: for the text formats, mark the formulas with
+            their line in the file, for tracebacks and debuggers.  Loading
+            without line numbers uses faster parsers (stdlib json).
         """
 
         extension = cls._filename_has_extension(filename) or next(
@@ -303,12 +817,18 @@ class ExcelCompiler:
         if not filename.endswith(extension):
             filename += '.' + extension
 
-        if extension[0] == 'p':
+        if extension == 'bin':
+            excel_compiler = cls._from_binary(
+                filename, use_mmap=use_mmap, lazy=lazy)
+        elif extension == 'zmodel':
+            excel_compiler = cls._from_compressed(filename, lazy=lazy)
+        elif extension[0] == 'p':
             with open(filename, 'rb') as f:
                 excel_compiler = pickle.load(f)
         else:
             excel_compiler = cls._from_text(
-                filename, is_json=extension == 'json')
+                filename, is_json=extension == 'json', lazy=lazy,
+                line_numbers=line_numbers)
 
         return excel_compiler
 
@@ -320,12 +840,12 @@ class ExcelCompiler:
             raise ImportError("Package 'pydot' is not installed")
 
         from networkx.drawing.nx_pydot import write_dot
-        filename = filename or (self.filename + '.dot')
+        filename = filename or self._default_filename('.dot')
         write_dot(self.dep_graph, filename)
 
     def export_to_gexf(self, filename=None):
         from networkx.readwrite.gexf import write_gexf
-        filename = filename or (self.filename + '.gexf')
+        filename = filename or self._default_filename('.gexf')
         write_gexf(self.dep_graph, filename)
 
     def plot_graph(self, layout_type='spring_layout'):
@@ -375,6 +895,8 @@ class ExcelCompiler:
         cell_or_range = self.cell_map[address]
 
         if cell_or_range.value != value:  # pragma: no branch
+            self._save_value(cell_or_range)
+
             # need to be able to 'set' an empty cell
             if cell_or_range.value is None:
                 cell_or_range.value = value
@@ -385,16 +907,53 @@ class ExcelCompiler:
             # set the value
             cell_or_range.value = value
 
+    def snapshot_values(self):
+        """ Start keeping the values of the cells, to restore them later
+
+        Until `restore_values`, the value of each cell or range is saved
+        the first time it changes, so restoring is proportional to the
+        number of cells changed, not the size of the model.  Only the last
+        snapshot can be restored.
+
+        :return: the snapshot, the saved values of the changed cells
+        """
+        self._saved_values = {}
+        return self._saved_values
+
+    def restore_values(self, snapshot):
+        """ Restore the cells to their values at `snapshot_values`
+
+        For example to run each of several scenarios from the same baseline.
+        The snapshot can be restored again, after more changes.
+
+        :param snapshot: the snapshot from the last `snapshot_values`
+        """
+        if snapshot is not self._saved_values:
+            raise ValueError('Can only restore the last snapshot')
+
+        for cell, value in snapshot.items():
+            cell.value = value
+            if isinstance(cell, _CellRange):
+                cell.lazy_range = None
+        snapshot.clear()
+
+    def _save_value(self, cell):
+        """Save the value of a cell, when first changed since the snapshot"""
+        if self._saved_values is not None and cell not in self._saved_values:
+            self._saved_values[cell] = cell.value
+
     def _reset(self, cell):
-        if cell.value is None:
+        if cell.value is None and getattr(cell, 'lazy_range', None) is None:
             return
         self.log.info("Resetting {}".format(cell.address))
+        self._save_value(cell)
         cell.value = None
+        if isinstance(cell, _CellRange):
+            cell.lazy_range = None
 
         if cell in self.dep_graph:
             for child_cell in self.dep_graph.successors(cell):
-                if child_cell.value is not None:
-                    self._reset(child_cell)
+                self._reset(child_cell)
 
     def value_tree_str(self, address, indent=0):
         """Generator which returns a formatted dependency graph"""
@@ -408,15 +967,183 @@ class ExcelCompiler:
         """Recalculate all of the known cells"""
         for cell in self.cell_map.values():
             if isinstance(cell, _CellRange) or cell.formula:
+                self._save_value(cell)
                 cell.value = None
                 cell.iterations = 0
+            if isinstance(cell, _CellRange):
+                cell.lazy_range = None
+
+        for cell in self.calc_chain:
+            self._evaluate(cell.address.address)
 
         for cell in self.cell_map.values():
             if isinstance(cell, _CellRange):
-                self._evaluate_range(cell.address.address)
+                if not self.lazy_ranges:
+                    self._evaluate_range(cell.address.address)
             else:
                 self._evaluate(cell.address.address)
 
+    def finalize(self):
+        """ Release the workbook, once the model has been built
+
+        Everything still needed from the workbook is built first: the rest
+        of the dependency graph, and the python code of the formulas, which
+        resolves defined names, table references and the shape of linest
+        ranges.  Then the references to the workbook are dropped, so the
+        memory it uses can be freed.  Only the cells already in the model
+        can be evaluated after this, as for a model loaded with `from_file`.
+        """
+        self._process_gen_graph()
+
+        # the calc chain and python code are built when first used
+        self.calc_chain
+        for cell in self.cell_map.values():
+            if cell.formula is not None:
+                cell.formula.python_code
+            cell.excel = None
+
+        self.excel = None
+        self._shared_formulas = {}
+
+    def update_from(self, filename):
+        """ Update the model from a changed version of the workbook
+
+        The cells already in the model are compared with the new workbook.
+        Only formulas which changed are parsed and linked to their (possibly
+        new) precedents, and only the cells which depend on a changed cell
+        are reset to be evaluated again.
+
+        :param filename: the changed workbook, as for `ExcelCompiler`
+        :return: the addresses of the cells and ranges which changed
+        """
+        excel = ExcelOpxWrapper(filename=filename)
+        excel.connect()
+        self.excel = excel
+        self._excel_connected = True
+        self._saved_values = None
+        self.filename = filename if isinstance(
+            filename, str) else excel.filename
+        self._excel_file_md5_digest = self._compute_excel_file_md5_digest
+        self._formula_cells_dict = {}
+        self._shared_formulas = {}
+        self._calc_chain = None
+
+        changed = []
+        for address, cell in list(self.cell_map.items()):
+            cell.excel = excel
+            formula, value = self._formula_and_value(cell)
+            if self._formula_changed(cell, formula):
+                self._update_formula(cell, formula)
+            elif (cell.formula or isinstance(cell, _CellRange) or
+                    value == cell.value):
+                continue
+
+            changed.append(address)
+            if cell in self.dep_graph:
+                for child_cell in self.dep_graph.successors(cell):
+                    self._reset(child_cell)
+            cell.value = None if cell.formula else value
+            if isinstance(cell, _CellRange):
+                cell.lazy_range = None
+
+        # build and link the precedents of the changed formulas
+        self._process_gen_graph()
+        return tuple(changed)
+
+    def _formula_and_value(self, cell):
+        """The formula and value, in the current workbook, of a model cell"""
+        try:
+            excel_data = self.excel.get_range(cell.address)
+        except KeyError:
+            # the sheet is gone
+            return None, None
+
+        if isinstance(cell, _CellRange):
+            formula = excel_data.formula
+            if isinstance(formula, str):
+                formula = '=' + formula[2:-1]
+            else:
+                formula = None
+            return formula, None
+
+        if cell.address.is_range:
+            # unbounded ranges refer to the range bounded by the data
+            return REF_FORMAT.format(excel_data.address), None
+
+        return excel_data.formula or None, excel_data.values
+
+    @staticmethod
+    def _formula_changed(cell, formula):
+        if cell.formula is None or formula is None:
+            return cell.formula is not formula
+
+        if cell.formula.base_formula is None:
+            # loaded from a text file, so only the python code is known
+            return (ExcelFormula(formula, cell=cell).python_code !=
+                    cell.formula.python_code)
+
+        return formula != cell.formula.base_formula
+
+    def _update_formula(self, cell, formula):
+        """Replace the formula of a cell, and unlink its old precedents"""
+        if cell in self.dep_graph:
+            self.dep_graph.remove_edges_from(
+                list(self.dep_graph.in_edges(cell)))
+
+        cell.formula = formula and ExcelFormula(formula, cell=cell) or None
+        if cell.formula:
+            if isinstance(cell, _Cell):
+                self._setup_formula(cell)
+            self.dep_graph.add_node(
+                cell, sheet=cell.sheet, label=cell.address.coordinate)
+            self.graph_todos.append(cell)
+
+    @property
+    def calc_chain(self):
+        """ The formula cells in the workbook's calc chain order, if usable
+
+        The calc chain is only used if every formula cell which a cell in
+        the chain depends on comes earlier in the chain.  Evaluating in that
+        order then finds the precedents of each cell already evaluated.
+        """
+        if not self.use_calc_chain:
+            return ()
+
+        if self._calc_chain is None or \
+                self._calc_chain[0] != len(self.cell_map):
+            self._connect_excel()
+            position = {}
+            for address in self.excel.get_calc_chain():
+                cell = self.cell_map.get(address.address)
+                if cell is not None and cell.formula and cell not in position:
+                    position[cell] = len(position)
+
+            # formula cells not in the chain sort after all of the chain
+            range_positions = {}
+
+            def last_position(cell):
+                last = -1
+                for precedent in self.dep_graph.predecessors(cell):
+                    if isinstance(precedent, _CellRange):
+                        if precedent not in range_positions:
+                            range_positions[precedent] = \
+                                last_position(precedent)
+                        last = max(last, range_positions[precedent])
+                    elif precedent.formula:
+                        last = max(last, position.get(
+                            precedent, len(position)))
+                return last
+
+            chain = tuple(position)
+            if not all(last_position(cell) < position[cell]
+                       for cell in chain):
+                self.log.info('Calc chain does not match the dependency '
+                              'graph, not used')
+                chain = ()
+            self._calc_chain = len(self.cell_map), chain
+
+        return self._calc_chain[1]
+
     def trim_graph(self, input_addrs, output_addrs):
         """Remove unneeded cells from the graph"""
         input_addrs = tuple(AddressRange(addr).address for addr in input_addrs)
@@ -474,7 +1201,10 @@ class ExcelCompiler:
                 if child_address not in processed_cells:  # pragma: no branch
                     processed_cells.add(child_address)
                     child_cell = self.cell_map[child_address]
-                    if child_address in needed_cells or ':' in child_address:
+                    if ':' in child_address:
+                        needed_cells.add(child_address)
+                        walk_precedents(child_cell)
+                    elif child_address in needed_cells:
                         walk_precedents(child_cell)
                     else:
                         # trim this cell, now we will need only its value
@@ -542,6 +1272,7 @@ class ExcelCompiler:
                             "No Orig data?: {}: {}".format(addr, cell.value))
                         continue
 
+                    self._save_value(cell)
                     cell.value = None
                     self._evaluate(addr.address)
 
@@ -594,6 +1325,7 @@ class ExcelCompiler:
 
     def formula_cells(self, sheet=None):
         """Iterate all cells and find cells with formulas"""
+        self._connect_excel()
         if sheet is None:
             return list(it.chain.from_iterable(
                 self.formula_cells(sheet.title)
@@ -630,6 +1362,7 @@ class ExcelCompiler:
         def build_cell(excel_cell):
             a_cell = _Cell(excel_cell.address, value=excel_cell.values,
                            formula=excel_cell.formula, excel=self.excel)
+            self._setup_formula(a_cell)
             self.cell_map[str(excel_cell.address)] = a_cell
             return [a_cell]
 
@@ -642,6 +1375,7 @@ class ExcelCompiler:
                 for addr, value, formula in a_range.cells_to_build(excel_range):
                     if addr.address not in self.cell_map:
                         a_cell = _Cell(addr, value, formula, self.excel)
+                        self._setup_formula(a_cell)
                         self.cell_map[addr.address] = a_cell
                         added.append(a_cell)
             else:
@@ -670,23 +1404,65 @@ class ExcelCompiler:
                 # nodes to analyze: only ranges and formulas have precedents
                 add_node_to_graph(new_node)
 
-    def _evaluate_range(self, address):
-        """Evaluate a range"""
-        if address == 'None':
-            return NULL_ERROR
+    def _setup_formula(self, cell):
+        """Attach the formula cache, and derive shared formulas from master"""
+        if cell.formula is None or cell.formula.base_formula is None:
+            return
 
+        cell.formula.formula_cache = self.formula_cache
+        # duck typed wrappers may not provide the shared formulas
+        get_shared_formula = getattr(self.excel, 'get_shared_formula', None)
+        shared = get_shared_formula and get_shared_formula(cell.address)
+        if shared is not None:
+            master_address, master_formula = shared
+            master = self._shared_formulas.get(master_address)
+            if master is None:
+                master = self._shared_formulas[master_address] = \
+                    ExcelFormula(master_formula)
+            cell.formula.share_rpn(
+                master,
+                cell.address.row - master_address.row,
+                cell.address.col_idx - master_address.col_idx)
+
+    def _get_cell_range(self, address):
         cell_range = self.cell_map.get(address)
         if cell_range is None:
             # we don't save the _CellRange values in the text format files
             assert '!' in address, "{} missing sheetname".format(address)
             self._gen_graph(address)
             cell_range = self.cell_map[address]
+        return cell_range
+
+    def _evaluate_lazy_range(self, address):
+        """Evaluate a range, for a function param which accepts `LazyRange`"""
+        if address == 'None':
+            return self._evaluate_range(address)
+
+        cell_range = self._get_cell_range(address)
+        if cell_range.value is not None or cell_range.formula is not None:
+            # already evaluated or a CSE Array Formula
+            return self._evaluate_range(address)
+
+        if cell_range.lazy_range is None:
+            self._save_value(cell_range)
+            addresses = cell_range.addresses
+            cell_range.lazy_range = LazyRange(
+                cell_range.size,
+                lambda row, col: self._evaluate(addresses[row][col].address))
+        return cell_range.lazy_range
+
+    def _evaluate_range(self, address):
+        """Evaluate a range"""
+        if address == 'None':
+            return NULL_ERROR
+
+        cell_range = self._get_cell_range(address)
 
         if cell_range.value is None:
             self.log.debug("Evaluating: {}, {}".format(
                 cell_range.address, cell_range.python_code))
             if cell_range.formula is None:
-                data = tuple(
+                data = RangeValues(
                     tuple(self._evaluate(addr.address) for addr in row)
                     for row in cell_range.addresses
                 )
@@ -696,6 +1472,7 @@ class ExcelCompiler:
             self.log.info("Range %s evaluated to '%s'" % (
                 cell_range.address, data))
 
+            self._save_value(cell_range)
             cell_range.value = data
 
         return cell_range.value
@@ -710,6 +1487,7 @@ class ExcelCompiler:
                 self._evaluate_range(cell.address.address)
 
             elif cell.python_code:
+                self._save_value(cell)
                 if (self._max_iterations is not None and
                         cell.iterations > self._max_iterations):
                     cell.value = 0
@@ -748,6 +1526,7 @@ class ExcelCompiler:
 
             # get the sheet if not specified
             if not address.has_sheet:
+                self._connect_excel()
                 address = AddressRange(
                     address, sheet=self.excel.get_active_sheet_name())
 
@@ -760,6 +1539,9 @@ class ExcelCompiler:
                     cell.iterations = 0
 
         result = self._evaluate(str(address))
+        if not _recursed and self.formula_cache is not None:
+            self.formula_cache.commit()
+
         if isinstance(result, tuple):
             # trim excess dimensions
             if len(result[0]) == 1:
@@ -786,6 +1568,7 @@ class ExcelCompiler:
 
         # get/set the current sheet
         if not seed.has_sheet:
+            self._connect_excel()
             seed = AddressRange(seed, sheet=self.excel.get_active_sheet_name())
 
         if '[' in seed.sheet:
@@ -796,6 +1579,7 @@ class ExcelCompiler:
             return
 
         # process the seed
+        self._connect_excel()
         self._make_cells(seed)
 
         if not recursed:
@@ -817,11 +1601,16 @@ class ExcelCompiler:
                 self.dep_graph.add_edge(
                     self.cell_map[precedent_address.address], dependant)
 
-        # calc the values for ranges
-        for range_todo in reversed(self.range_todos):
-            self._evaluate_range(range_todo)
+        # calc the values for ranges, lazy ranges only calc as accessed
+        if not self.lazy_ranges:
+            for range_todo in reversed(self.range_todos):
+                self._evaluate_range(range_todo)
         self.range_todos = []
 
+        if self.formula_cache is not None:
+            self.formula_cache.commit()
+        self._grow_cache()
+
         self.log.info(
             "Graph construction done, %s nodes, "
             "%s edges, %s self.cell_map entries" % (
@@ -831,6 +1620,409 @@ class ExcelCompiler:
         )
 
 
+def _model_fingerprint(data):
+    """ Hash of the cells of a text format model
+
+    A snapshot of the evaluated values is only used if the cells which
+    they were evaluated from are unchanged.
+    """
+    return hashlib.md5(json.dumps((
+        data['excel_hash'],
+        sorted(data['cell_map'].items()),
+        list(data.get('formula_templates', ())),
+    ), default=str).encode()).hexdigest()
+
+
+def _relative_address(address, cell_address):
+    """R1C1 address relative to the cell, for unbounded ranges also"""
+    def offsets(addr):
+        return ''.join((
+            'R[{}]'.format(addr.row - cell_address.row) if addr.row else '',
+            'C[{}]'.format(addr.col_idx - cell_address.col_idx)
+            if addr.col_idx else '',
+        ))
+
+    if address.is_range:
+        relative = '{}:{}'.format(offsets(address.start), offsets(address.end))
+    else:
+        relative = offsets(address)
+    return '{}!{}'.format(address.sheet, relative)
+
+
+def _formula_template(python_code, cell_address):
+    """ The python code with its addresses relative to the cell
+
+    :return: the template, or None if it does not expand to the same code
+    """
+    template = CODE_ADDRESS_RE.sub(lambda match: '{}("{}")'.format(
+        match.group(1),
+        _relative_address(AddressRange(match.group(2)), cell_address)
+    ), python_code)
+
+    if _expand_formula_template(template, cell_address) == python_code:
+        return template
+
+
+def _expand_formula_template(template, cell_address):
+    """The python code for the cell from a template, see `_formula_template`
+    """
+    return CODE_ADDRESS_RE.sub(lambda match: '{}("{}")'.format(
+        match.group(1),
+        AddressRange.create(match.group(2), cell=cell_address)
+    ), template)
+
+
+def _formula_templates(cell_values):
+    """ Replace formulas which are copies of each other with a template id
+
+    The cells of a formula copied down or across differ only in their
+    addresses, and share the same template when their addresses are
+    relative to the cell.  These are stored once, and the cells refer
+    to them as `=#<template id>`.
+
+    :param cell_values: sequence of address, value (or `=python_code`)
+    :return: list of address, value and the list of templates
+    """
+    cell_templates = {}
+    for addr, value in cell_values:
+        if isinstance(value, str) and value.startswith('='):
+            address = AddressRange(addr)
+            if not address.is_range:
+                cell_templates[addr] = _formula_template(value[1:], address)
+
+    counts = collections.Counter(cell_templates.values())
+    template_ids = {}
+    templated = []
+    for addr, value in cell_values:
+        template = cell_templates.get(addr)
+        if template is not None and counts[template] > 1:
+            value = '{}{}'.format(TEMPLATE_START, template_ids.setdefault(
+                template, len(template_ids)))
+        templated.append((addr, value))
+    return templated, list(template_ids)
+
+
+def _graph_node_attributes(cell):
+    if isinstance(cell, _CellRange) or cell.formula:
+        return dict(sheet=cell.sheet, label=cell.address.coordinate)
+    return {}
+
+
+def _dumps(value):
+    """marshal a value, or pickle it if it has types marshal can not store"""
+    try:
+        return b'm' + marshal.dumps(value)
+    except ValueError:
+        return b'p' + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(data):
+    """load a value stored with `_dumps`"""
+    if data[:1] == b'p':
+        return pickle.loads(data[1:])
+    return marshal.loads(data[1:])
+
+
+class _BinaryModel:
+    """ Read only view of a binary format model, over bytes or an mmap
+
+    The arrays are used in place, so a memory mapped file is shared by
+    every process mapping it.  Strings, values and code are decoded as
+    they are accessed.
+    """
+
+    VALUE = -1
+    RANGE = -2
+
+    def __init__(self, buffer, filename):
+        view = memoryview(buffer)
+        magic, version, python_magic, meta_size = \
+            BINARY_HEADER.unpack_from(view)
+        if magic != BINARY_MAGIC:
+            raise ValueError("Not a pycel binary file: '{}'".format(filename))
+        if version != BINARY_FORMAT_VERSION:
+            raise ValueError(
+                "Unsupported binary format version {}: '{}'".format(
+                    version, filename))
+
+        # the code objects can only be used by the same python version
+        self.code_is_usable = python_magic == importlib.util.MAGIC_NUMBER
+
+        meta = _loads(
+            view[BINARY_HEADER.size:BINARY_HEADER.size + meta_size])
+        self.excel_hash = meta['excel_hash']
+        self.extra_data = meta['extra_data']
+
+        base = BINARY_HEADER.size + meta_size
+        base += -base % 8
+        for name, (offset, size, typecode) in meta['sections'].items():
+            section = view[base + offset:base + offset + size]
+            if typecode is not None:
+                if sys.byteorder == 'little':
+                    section = section.cast(typecode)
+                else:  # pragma: no cover
+                    section = array.array(typecode, section.tobytes())
+                    section.byteswap()
+            setattr(self, name, section)
+        self.size = len(self.addresses)
+
+    def string(self, index):
+        return str(self.strings[self.string_offsets[index]:
+                                self.string_offsets[index + 1]], 'utf-8')
+
+    def address(self, index):
+        return self.string(self.addresses[index])
+
+    def value(self, index):
+        return _loads(self.values[self.value_offsets[index]:
+                                  self.value_offsets[index + 1]])
+
+    def code(self, index):
+        """(marshalled code, names) for the cell's formula, if usable"""
+        start, end = self.code_offsets[index], self.code_offsets[index + 1]
+        if start == end or not self.code_is_usable:
+            return None
+        return self.codes[start:end].tobytes(), set(
+            self.string(self.names[index]).split())
+
+    def predecessors(self, index):
+        return self.preds[self.pred_offsets[index]:
+                          self.pred_offsets[index + 1]]
+
+    def successors(self, index):
+        return self.succs[self.succ_offsets[index]:
+                          self.succ_offsets[index + 1]]
+
+    def find(self, address):
+        """Index of the cell at this address, or None"""
+        index = bisect.bisect_left(_BinaryAddresses(self), address)
+        if index < self.size and self.address(index) == address:
+            return index
+        return None
+
+    def build_cell(self, index):
+        address = AddressRange(self.address(index))
+        python_code = self.python_codes[index]
+        if python_code == self.RANGE:
+            return _CellRange(ExcelOpxWrapper.RangeData(address, None, None))
+        elif python_code == self.VALUE:
+            return _Cell(address, value=self.value(index))
+
+        cell = _Cell(address, formula='=' + self.string(python_code))
+        code = self.code(index)
+        if code is not None:
+            cell.formula.marshalled_python = code
+        return cell
+
+
+class _BinaryAddresses:
+    """The sorted addresses of a `_BinaryModel` as a sequence, to bisect"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __len__(self):
+        return self.model.size
+
+    def __getitem__(self, index):
+        return self.model.address(index)
+
+
+class _MappedCellMap(dict):
+    """ cell_map over a (possibly memory mapped) `_BinaryModel`
+
+    Cells are built when first accessed, and linked in the dependency graph
+    to the cells already built.  Only the cells used, (and their computed
+    values), are held by the process.  Iterating only visits built cells.
+    """
+
+    def __init__(self, model, dep_graph):
+        super().__init__()
+        self.model = model
+        self.dep_graph = dep_graph
+        self.built = {}
+
+    def __missing__(self, address):
+        index = self.model.find(address)
+        if index is None:
+            raise KeyError(address)
+
+        cell = self.model.build_cell(index)
+        self[address] = self.built[index] = cell
+
+        attributes = _graph_node_attributes(cell)
+        if attributes:
+            self.dep_graph.add_node(cell, **attributes)
+        for pred in self.model.predecessors(index):
+            if pred in self.built:
+                self.dep_graph.add_edge(self.built[pred], cell)
+        for succ in self.model.successors(index):
+            if succ in self.built:
+                self.dep_graph.add_edge(cell, self.built[succ])
+        return cell
+
+    def __contains__(self, address):
+        return super().__contains__(address) or (
+            self.model.find(address) is not None)
+
+    def get(self, address, default=None):
+        try:
+            return self[address]
+        except KeyError:
+            return default
+
+
+def _compressor(compression):
+    """The stdlib module for the compression, zlib or lzma"""
+    if compression not in ('zlib', 'lzma'):
+        raise ValueError("Unknown compression: '{}'".format(compression))
+    return importlib.import_module(compression)
+
+
+class _CompressedCellMap(collections.abc.Mapping):
+    """ The cells of a compressed format model, by address
+
+    The cells of each sheet are decompressed the first time one of them
+    is looked up.
+    """
+
+    def __init__(self, data, filename):
+        magic, version, meta_size = COMPRESSED_HEADER.unpack_from(data)
+        if magic != COMPRESSED_MAGIC:
+            raise ValueError(
+                "Not a pycel compressed file: '{}'".format(filename))
+        if version != COMPRESSED_FORMAT_VERSION:
+            raise ValueError("Unsupported compressed format {}: '{}'".format(
+                version, filename))
+
+        start = COMPRESSED_HEADER.size
+        meta = _loads(data[start:start + meta_size])
+        self.excel_hash = meta['excel_hash']
+        self.extra_data = meta['extra_data']
+        self.sections = meta['sections']
+        self.sheets = {}
+        self._decompress = _compressor(meta['compression']).decompress
+        self._data = data
+        self._start = start + meta_size
+
+    def __getitem__(self, address):
+        sheet = address.rsplit('!', 1)[0]
+        if sheet not in self.sections:
+            raise KeyError(address)
+        if sheet not in self.sheets:
+            self.sheets[sheet] = self._load_sheet(sheet)
+        return self.sheets[sheet][address]
+
+    def __iter__(self):
+        self.decompress_all()
+        return it.chain.from_iterable(
+            self.sheets[sheet] for sheet in self.sections)
+
+    def __len__(self):
+        self.decompress_all()
+        return sum(map(len, self.sheets.values()))
+
+    def _load_sheet(self, sheet):
+        offset, size = self.sections[sheet]
+        offset += self._start
+        return _loads(self._decompress(self._data[offset:offset + size]))
+
+    def decompress_all(self):
+        """Decompress the sheets not yet used, in parallel threads"""
+        sheets = [sheet for sheet in self.sections if sheet not in self.sheets]
+        if sheets:
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                self.sheets.update(
+                    zip(sheets, executor.map(self._load_sheet, sheets)))
+
+
+class CompiledCache:
+    """ On disk cache of compilers, keyed on the workbook contents
+
+    Each entry is a pickle of a compiler, without its `ExcelWrapper`.
+    Reading an entry marks it as recently used, and adding an entry
+    removes the least recently used entries beyond `max_size` bytes.
+    """
+
+    DEFAULT_MAX_SIZE = 1 << 30
+    EXTENSION = '.pkl'
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(excel_hash, **options):
+        """Key on the workbook hash, the pycel version and compiler options"""
+        key = '{}|{}|{}'.format(
+            excel_hash, __version__, sorted(options.items()))
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + self.EXTENSION)
+
+    def get(self, key):
+        """Return the compiler for this key, or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                excel_compiler = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            # an unreadable entry (from an old pycel, truncated...) is a miss
+            logging.getLogger('pycel').warning(
+                'Removing unreadable cache entry {}: {}'.format(path, exc))
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process since it was read
+            return None
+        return excel_compiler
+
+    def put(self, key, excel_compiler):
+        """Add or replace the compiler for this key"""
+        path = self._path(key)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(excel_compiler, f)
+            os.replace(path + '.tmp', path)
+        finally:
+            if os.path.exists(path + '.tmp'):
+                os.unlink(path + '.tmp')
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries, to fit in max_size"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.EXTENSION):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # removed by another process sharing the cache
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
 class _CellBase:
 
     def __init__(self, address=None, formula='', excel=None):
@@ -841,6 +2033,7 @@ class _CellBase:
             formula_is_python_code=formula_is_python_code) or None
 
         if isinstance(excel, _CompiledImporter):
+            excel.set_line_number(address, self.formula)
             excel = None
         self.excel = excel
         self.address = AddressRange(address)
@@ -873,10 +2066,12 @@ class _CellRange(_CellBase):
         self.addresses = data.address.resolve_range
         self.size = data.address.size
         self.value = None
+        self.lazy_range = None
 
     def __getstate__(self):
         state = dict(self.__dict__)
         state['excel'] = None
+        state['lazy_range'] = None
         return state
 
     def __repr__(self):
@@ -936,9 +2131,31 @@ class _CompiledImporter:
     """Emulate the excel_wrapper for serialized files"""
     def __init__(self, filename, file_data):
         self.filename = filename.rsplit('.', maxsplit=1)[0]
+        self.text_filename = filename
         self.cell_map = file_data['cell_map']
+        self.formula_templates = file_data.get('formula_templates', ())
+        self.snapshot = {}
         self.compiler = None
 
+    def set_line_number(self, address, formula):
+        """Show the formula's line in the text file in tracebacks"""
+        lines = getattr(self.cell_map, 'lc', None)
+        if formula is not None and lines is not None:
+            template_id = self._template_id(self.cell_map[str(address)])
+            if template_id is not None:
+                # show the template's line, it has the formula's code
+                lines = self.formula_templates.lc
+                formula.lineno = lines.data[template_id][0] + 1
+            else:
+                formula.lineno = lines.data[str(address)][0] + 1
+            formula.filename = self.text_filename
+
+    @staticmethod
+    def _template_id(cell_value):
+        if isinstance(cell_value, str) and cell_value.startswith(
+                TEMPLATE_START):
+            return int(cell_value[len(TEMPLATE_START):])
+
     def get_range(self, address):
 
         if not address.is_bounded_range:
@@ -968,7 +2185,12 @@ class _CompiledImporter:
             return ExcelOpxWrapper.RangeData(address, '', None)
 
         elif isinstance(cell_value, str) and cell_value.startswith('='):
-            return ExcelOpxWrapper.RangeData(address, cell_value, None)
+            template_id = self._template_id(cell_value)
+            if template_id is not None:
+                cell_value = '=' + _expand_formula_template(
+                    self.formula_templates[template_id], address)
+            return ExcelOpxWrapper.RangeData(
+                address, cell_value, self.snapshot.get(str(address)))
 
         else:
             return ExcelOpxWrapper.RangeData(address, '', cell_value)
@@ -1,12 +1,17 @@
 import ast
+import hashlib
 import importlib
+import importlib.util
 import logging
 import marshal
 import math
+import sqlite3
 import sys
 import tokenize as tk
 
 import openpyxl.formula.tokenizer as tokenizer
+from openpyxl.formula.translate import Translator
+from openpyxl.utils import range_boundaries as openpyxl_range_boundaries
 from networkx.classes.digraph import DiGraph
 from networkx.exception import NetworkXError
 from pycel.excelutil import (
@@ -19,14 +24,22 @@ from pycel.excelutil import (
     in_array_formula_context,
     NAME_ERROR,
     PyCelException,
+    split_sheetname,
     uniqueify,
 )
-from pycel.lib.function_helpers import load_functions
+from pycel.lib.function_helpers import is_lazy_param, load_functions
 from pycel.lib.function_info import func_status_msg
+from pycel.version import __version__
 
 
 ADDR_FUNCS_NAMES = '_R_', '_C_', '_REF_'
 
+# ranges passed directly as a function param are evaluated via this name
+RANGE_PARAM_FUNC_NAME = '_RP_'
+
+# functions whose python code depends on the workbook or the formula's cell
+CONTEXT_FUNC_NAMES = frozenset(('column', 'linest', 'linestmario', 'row'))
+
 
 class FormulaParserError(PyCelException):
     """Error during parsing"""
@@ -516,6 +529,7 @@ class ExcelFormula:
         self.filename = ''
 
         self._rpn = None
+        self._shared_rpn = None
         self._ast = None
         self._needed_addresses = None
         self._compiled_python = None
@@ -523,6 +537,9 @@ class ExcelFormula:
         self.compiled_lambda = None
         self.msg = None
 
+        self.formula_cache = None
+        self._formula_cache_key = None
+
     def __str__(self):
         return self.base_formula or self.python_code
 
@@ -533,7 +550,8 @@ class ExcelFormula:
         # Throw everything away except the python code
         state = dict(self.__dict__)
         remove_names = 'compiled_lambda _compiled_python _ast _rpn ' \
-                       'base_formula _needed_addresses'
+                       'base_formula _needed_addresses formula_cache ' \
+                       '_formula_cache_key _shared_rpn'
         for to_remove in remove_names.split():
             if to_remove in state:  # pragma: no branch
                 state[to_remove] = None
@@ -542,7 +560,10 @@ class ExcelFormula:
     @property
     def rpn(self):
         if self._rpn is None:
-            self._rpn = self._parse_to_rpn(self.base_formula)
+            if self._shared_rpn is not None:
+                self._rpn = self._translate_rpn(*self._shared_rpn)
+            else:
+                self._rpn = self._parse_to_rpn(self.base_formula)
         return self._rpn
 
     @property
@@ -551,6 +572,35 @@ class ExcelFormula:
             self._ast = self._build_ast(self.rpn)
         return self._ast
 
+    def share_rpn(self, master, row_offset, col_offset):
+        """ Build the rpn from a shared formula master, instead of parsing
+
+        Excel stores copied formulas as a master formula and the offsets of
+        the cells sharing it.  The master is parsed once, and each sharing
+        cell gets a copy of its rpn with the references translated, when
+        the rpn is first needed.
+
+        :param master: ExcelFormula of the master cell
+        :param row_offset: rows from the master cell to this cell
+        :param col_offset: columns from the master cell to this cell
+        """
+        self._rpn = None
+        self._shared_rpn = master, row_offset, col_offset
+
+    def _translate_rpn(self, master, row_offset, col_offset):
+        rpn = []
+        for node in master.rpn:
+            token = node.token
+            if token.matches(Token.OPERAND, Token.RANGE):
+                value = Translator.translate_range(
+                    token.value, row_offset, col_offset)
+                token = Token.from_token(token, value=value)
+            new_node = self._ast_node(token)
+            if isinstance(node, FunctionNode):
+                new_node.num_args = node.num_args
+            rpn.append(new_node)
+        return rpn
+
     @property
     def needed_addresses(self):
         """Return the addresses and address ranges this formula needs"""
@@ -574,11 +624,17 @@ class ExcelFormula:
     @property
     def python_code(self):
         """Use the ast to generate python code"""
-        if self._python_code is None:
+        if self._python_code is None and not self._load_formula_cache():
             if self.ast is None:
                 self._python_code = ''
             else:
                 self._python_code = self.ast.emit
+
+            if self._formula_cache_key is not None:
+                if self._is_context_free:
+                    self._save_formula_cache()
+                else:
+                    self._formula_cache_key = None
         return self._python_code
 
     @property
@@ -599,9 +655,66 @@ class ExcelFormula:
                     raise FormulaParserError(
                         "Failed to compile expression {}: {}".format(
                             self.python_code, exc))
+                if self._formula_cache_key is not None:
+                    self._save_formula_cache()
 
         return self._compiled_python
 
+    @property
+    def marshalled_python(self):
+        """The compiled python code as (marshalled code, names), or None"""
+        try:
+            self.compiled_python
+        except FormulaParserError:
+            return None
+        return self._marshalled_python
+
+    @marshalled_python.setter
+    def marshalled_python(self, value):
+        self._marshalled_python = value
+        self._compiled_python = None
+
+    @property
+    def _is_context_free(self):
+        """Is the python code determined by the formula and sheet alone?
+
+        Defined names, tables and references to the formula's own cell
+        (ROW(), LINEST...) need the workbook to be translated.
+        """
+        for node in self.rpn or ():
+            if isinstance(node, FunctionNode):
+                name = node.value.lower().strip('(').replace('_xlfn.', '')
+                if name in CONTEXT_FUNC_NAMES:
+                    return False
+            elif node.token.matches(Token.OPERAND, Token.RANGE):
+                try:
+                    addr = split_sheetname(node.value.replace('$', ''))[1]
+                    boundaries = openpyxl_range_boundaries(addr)
+                except (NotImplementedError, ValueError):
+                    return False
+                if None in boundaries and ':' not in addr:
+                    return False
+        return True
+
+    def _load_formula_cache(self):
+        """Load the python code, and compiled code if any, from the cache"""
+        if self.formula_cache is None or not self.base_formula:
+            return False
+
+        sheet = self.cell and self.cell.sheet or ''
+        self._formula_cache_key = self.formula_cache.key(
+            self.base_formula, sheet)
+        cached = self.formula_cache.get(self._formula_cache_key)
+        if cached is None:
+            return False
+
+        self._python_code, self._marshalled_python = cached
+        return True
+
+    def _save_formula_cache(self):
+        self.formula_cache.put(self._formula_cache_key, self._python_code,
+                               self._marshalled_python)
+
     def _ast_node(self, token):
         return ASTNode.create(token, self.cell)
 
@@ -787,8 +900,8 @@ class ExcelFormula:
         return stack[0]
 
     @classmethod
-    def build_eval_context(cls, evaluate, evaluate_range,
-                           logger=None, plugins=None):
+    def build_eval_context(cls, evaluate, evaluate_range, logger=None,
+                           plugins=None, evaluate_lazy_range=None):
         """eval with namespace management.  Will auto import needed functions
 
         Used like:
@@ -799,6 +912,9 @@ class ExcelFormula:
         :param evaluate_range: a function to evaluate a range address
         :param logger: a logger to use (defaults to pycel)
         :param plugins: module paths for plugin lib functions
+        :param evaluate_lazy_range: a function to build a `LazyRange` for a
+            range address.  Used for params marked with `lazy_params`.  If
+            None, ranges are always evaluated with `evaluate_range`
         :return: a function to evaluate a compiled expression from build_ast
         """
 
@@ -842,6 +958,27 @@ class ExcelFormula:
                 raise exc(error_msg)
             return error_msg
 
+        def evaluate_range_param(func, param_idx, address):
+            """evaluate a range which is passed directly to a function"""
+            return evaluate_range(address)
+
+        def build_evaluate_lazy_range_param():
+            """evaluate ranges passed to functions, lazily if the param allows
+
+            Built for each formula, so each function param is checked once
+            """
+            lazy_params = {}
+
+            def evaluate_lazy_range_param(func, param_idx, address):
+                key = func, param_idx
+                is_lazy = lazy_params.get(key)
+                if is_lazy is None:
+                    is_lazy = lazy_params[key] = is_lazy_param(func, param_idx)
+                if is_lazy:
+                    return evaluate_lazy_range(address)
+                return evaluate_range(address)
+            return evaluate_lazy_range_param
+
         def load_function(excel_formula, name_space):
             """exec the code into our address space"""
 
@@ -849,6 +986,11 @@ class ExcelFormula:
             # referencing other cells or a range of cells
             name_space['_C_'] = evaluate
             name_space['_R_'] = evaluate_range
+            if evaluate_lazy_range is None:
+                name_space[RANGE_PARAM_FUNC_NAME] = evaluate_range_param
+            else:
+                name_space[RANGE_PARAM_FUNC_NAME] = \
+                    build_evaluate_lazy_range_param()
             name_space['_REF_'] = AddressRange.create
             name_space['pi'] = math.pi
 
@@ -944,6 +1086,19 @@ class ExcelFormula:
                     return node
                 return self.replace_op(node, node.left, node.op, node.right)
 
+            def visit_Call(self, node):
+                """ tag ranges passed as params with the receiving function """
+                node = ast.NodeTransformer.generic_visit(self, node)
+                if isinstance(node.func, ast.Name) and \
+                        node.func.id not in ADDR_FUNCS_NAMES:
+                    for i, arg in enumerate(node.args):
+                        if self.is_range_call(arg):
+                            arg.func.id = RANGE_PARAM_FUNC_NAME
+                            arg.args = [ast.Name(id=node.func.id,
+                                                 ctx=ast.Load()),
+                                        ast.Num(n=i)] + arg.args
+                return node
+
             def visit_UnaryOp(self, node):
                 """ change the UnaryOp node to a function node """
                 node = ast.NodeTransformer.generic_visit(self, node)
@@ -963,6 +1118,12 @@ class ExcelFormula:
                     col_offset=node.col_offset,
                 )
 
+            @staticmethod
+            def is_range_call(node):
+                return (isinstance(node, ast.Call) and
+                        isinstance(node.func, ast.Name) and
+                        node.func.id == '_R_' and len(node.args) == 1)
+
             def is_addr_and(self, node):
                 # reference intersection does not get fixup
                 return (isinstance(node.left, ast.Call) and
@@ -977,3 +1138,70 @@ class ExcelFormula:
         # compile the tree
         self._compiled_python = compile(tree, **kwargs), names
         self._marshalled_python = marshal.dumps(self._compiled_python[0]), names
+
+
+class FormulaCache:
+    """ Persistent cache of formula translations, shared across workbooks
+
+    Maps an Excel formula and the sheet it is on, to its python code and
+    marshalled code object, in a sqlite file.  Formulas which need the
+    workbook to be translated (defined names, tables, ROW()...) are not
+    cached.  Entries are keyed on the pycel and python versions.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS formulas ('
+            'key TEXT PRIMARY KEY, python_code TEXT, code BLOB, names TEXT)')
+        self.connection.commit()
+        self._pending = 0
+
+    @staticmethod
+    def key(formula, sheet):
+        """Key on the formula, sheet, pycel version and python bytecode"""
+        key = '{}|{}|{}|{}'.format(
+            __version__, importlib.util.MAGIC_NUMBER.hex(), sheet, formula)
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def get(self, key):
+        """ Fetch a cached translation
+
+        :param key: from `key`
+        :return: (python_code, (marshalled code, names) or None) or None
+        """
+        row = self.connection.execute(
+            'SELECT python_code, code, names FROM formulas WHERE key = ?',
+            (key, )).fetchone()
+        if row is None:
+            return None
+        python_code, code, names = row
+        return python_code, code and (code, set(names.split()))
+
+    def put(self, key, python_code, marshalled=None):
+        """ Add or update a cached translation
+
+        :param key: from `key`
+        :param python_code: the formula's python code
+        :param marshalled: (marshalled code, names) if compiled
+        """
+        code, names = marshalled or (None, ())
+        self.connection.execute(
+            'INSERT OR REPLACE INTO formulas VALUES (?, ?, ?, ?)',
+            (key, python_code, code, ' '.join(sorted(names))))
+        self._pending += 1
+        if self._pending >= self.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        """Write the pending translations to the file"""
+        if self._pending:
+            self.connection.commit()
+            self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -1,10 +1,8 @@
 """
 Python equivalents of various excel functions
 """
-import itertools as it
 
 from bisect import bisect_right
-from collections import Counter
 from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP, ROUND_UP
 import math
@@ -14,22 +12,26 @@ from pycel.excelutil import (
     assert_list_like,
     build_wildcard_re,
     coerce_to_string,
+    criteria_mask_builder,
     date_from_int,
     DIV0,
     ERROR_CODES,
     ExcelCmp,
-    find_corresponding_index,
     flatten,
     is_leap_year,
     is_number,
+    LazyRange,
     list_like,
+    LookupVector,
     MAX_COL,
     MAX_ROW,
     NA_ERROR,
     NUM_ERROR,
     normalize_year,
     PyCelException,
+    RangeValues,
     REF_ERROR,
+    TypedRangeView,
     VALUE_ERROR,
 )
 
@@ -53,6 +55,38 @@ def _numerics(*args, keep_bools=False):
         return tuple(x for x in args if isinstance(x, (int, float)))
 
 
+def _criteria_mask(*args):
+    """ Boolean mask of the cells which meet all of the criteria
+
+    :param args: pairs of range and criteria
+    :return: numpy boolean array, or None if the ranges' sizes don't match
+    """
+    mask = None
+    for rng, criteria in zip(args[0::2], args[1::2]):
+        rng_mask = criteria_mask_builder(criteria)(TypedRangeView.create(rng))
+        if mask is None:
+            mask = rng_mask
+        elif mask.shape != rng_mask.shape:
+            return None
+        else:
+            mask = mask & rng_mask
+    return mask
+
+
+def _row(array, row_idx):
+    """A row from a range, as a `LookupVector` or `LazyVector` if possible"""
+    if isinstance(array, (LazyRange, RangeValues)):
+        return array.row(row_idx)
+    return array[row_idx]
+
+
+def _column(array, col_idx):
+    """A column from a range, as a `LookupVector` or `LazyVector` if possible"""
+    if isinstance(array, (LazyRange, RangeValues)):
+        return array.column(col_idx)
+    return tuple(row[col_idx] for row in array)
+
+
 def average(*args):
     data = _numerics(*args)
 
@@ -138,13 +172,7 @@ def countif(range, criteria):
     # Excel reference: https://support.office.com/en-us/article/
     #   COUNTIF-function-e0de10c6-f885-4e71-abb4-1f464816df34
 
-    # WARNING:
-    # - wildcards not supported  ::TODO:: test if this is no longer true
-    # - support of strings with >, <, <=, =>, <> not provided
-
-    valid = find_corresponding_index(range, criteria)
-
-    return len(valid)
+    return np.count_nonzero(_criteria_mask(range, criteria))
 
 
 def countifs(*args):
@@ -155,13 +183,10 @@ def countifs(*args):
         raise PyCelException('excellib.countifs() must have a '
                              'pair number of arguments, here %d' % len(args))
 
-    index_counts = Counter(it.chain.from_iterable(
-        find_corresponding_index(rng, criteria)
-        for rng, criteria in zip(args[0::2], args[1::2])))
-
-    ifs_count = len(args) // 2
-    return len(tuple(idx for idx, cnt in index_counts.items()
-                     if cnt == ifs_count))
+    mask = _criteria_mask(*args)
+    if mask is None:
+        return VALUE_ERROR
+    return np.count_nonzero(mask)
 
 
 @excel_helper(number_params=-1)
@@ -215,7 +240,7 @@ def floor(number, significance):
     return significance * int(number / significance)
 
 
-@excel_helper(cse_params=0, bool_params=3, number_params=2)
+@excel_helper(cse_params=0, bool_params=3, number_params=2, lazy_params=1)
 def hlookup(lookup_value, table_array, row_index_num, range_lookup=True):
     """ Horizontal Lookup
 
@@ -238,7 +263,7 @@ def hlookup(lookup_value, table_array, row_index_num, range_lookup=True):
         return REF_ERROR
 
     result_idx = _match(
-        lookup_value, table_array[0], match_type=bool(range_lookup))
+        lookup_value, _row(table_array, 0), match_type=bool(range_lookup))
 
     if isinstance(result_idx, int):
         return table_array[row_index_num - 1][result_idx - 1]
@@ -247,7 +272,7 @@ def hlookup(lookup_value, table_array, row_index_num, range_lookup=True):
         return result_idx
 
 
-@excel_helper(number_params=(1, 2))
+@excel_helper(number_params=(1, 2), lazy_params=0)
 def index(array, row_num, col_num=None):
     # Excel reference: https://support.office.com/en-us/article/
     #   index-function-a5dcf0dd-996d-40a4-a822-b56b061328bd
@@ -366,7 +391,7 @@ def log(number, base=10):
     return math.log(number, base)
 
 
-@excel_helper(cse_params=0)
+@excel_helper(cse_params=0, lazy_params=(1, 2))
 def lookup(lookup_value, lookup_array, result_range=None):
     """
     There are two ways to use LOOKUP: Vector form and Array form
@@ -392,10 +417,10 @@ def lookup(lookup_value, lookup_array, result_range=None):
 
     # match across the largest dimension
     if width <= height:
-        match_idx = _match(lookup_value, tuple(i[0] for i in lookup_array))
-        result = tuple(i[-1] for i in lookup_array)
+        match_idx = _match(lookup_value, _column(lookup_array, 0))
+        result = _column(lookup_array, -1)
     else:
-        match_idx = _match(lookup_value, lookup_array[0])
+        match_idx = _match(lookup_value, _row(lookup_array, 0))
         result = lookup_array[-1]
 
     if len(lookup_array) > 1 and len(lookup_array[0]) > 1:
@@ -404,7 +429,7 @@ def lookup(lookup_value, lookup_array, result_range=None):
 
     elif result_range:
         if len(result_range) > len(result_range[0]):
-            result = tuple(i[0] for i in result_range)
+            result = _column(result_range, 0)
         else:
             result = result_range[0]
 
@@ -416,12 +441,12 @@ def lookup(lookup_value, lookup_array, result_range=None):
         return match_idx
 
 
-@excel_helper(cse_params=0, number_params=2)
+@excel_helper(cse_params=0, number_params=2, lazy_params=1)
 def match(lookup_value, lookup_array, match_type=1):
     if len(lookup_array) == 1:
-        lookup_array = lookup_array[0]
+        lookup_array = _row(lookup_array, 0)
     else:
-        lookup_array = tuple(row[0] for row in lookup_array)
+        lookup_array = _column(lookup_array, 0)
 
     return _match(lookup_value, lookup_array, match_type)
 
@@ -456,12 +481,18 @@ def _match(lookup_value, lookup_array, match_type=1):
     if match_type == 1:
         # Use a binary search to speed it up.  Excel seems to do this as it
         # would explain the results seen when doing out of order searches.
-        lookup_value = ExcelCmp(lookup_value)
+        if isinstance(lookup_array, LookupVector):
+            # bisect the cached keys, and skip back to the matching type
+            keys, last_of_type = lookup_array.sort_keys(lookup_value)
+            result = bisect_right(keys, lookup_value[:2])
+            result = result and last_of_type[result - 1]
+
+        else:
+            result = bisect_right(lookup_array, lookup_value)
+            while result and lookup_value.cmp_type != ExcelCmp(
+                    lookup_array[result - 1]).cmp_type:
+                result -= 1
 
-        result = bisect_right(lookup_array, lookup_value)
-        while result and lookup_value.cmp_type != ExcelCmp(
-                lookup_array[result - 1]).cmp_type:
-            result -= 1
         if result == 0:
             result = NA_ERROR
         return result
@@ -469,19 +500,25 @@ def _match(lookup_value, lookup_array, match_type=1):
     result = [NA_ERROR]
 
     if match_type == 0:
-        def compare(idx, val):
-            if val == lookup_value:
-                result[0] = idx
-                return True
-
+        re_compare = None
         if lookup_value.cmp_type == 1:
             # string matches might be wildcards
             re_compare = build_wildcard_re(lookup_value.value)
-            if re_compare is not None:
-                def compare(idx, val):  # noqa: F811
-                    if re_compare(val.value):
-                        result[0] = idx
-                        return True
+
+        if re_compare is not None:
+            def compare(idx, val):
+                if re_compare(val.value):
+                    result[0] = idx
+                    return True
+
+        elif isinstance(lookup_array, LookupVector):
+            return lookup_array.index.get(lookup_value[:2], NA_ERROR)
+
+        else:
+            def compare(idx, val):
+                if val == lookup_value:
+                    result[0] = idx
+                    return True
     else:
         def compare(idx, val):
             if val < lookup_value:
@@ -611,16 +648,20 @@ def sumifs(sum_range, *args):
         assert size == (len(rng), len(rng[0])), \
             "Size mismatch criteria range, sum range"
 
-    # count the number of times a particular cell matches the criteria
-    index_counts = Counter(it.chain.from_iterable(
-        find_corresponding_index(rng, criteria)
-        for rng, criteria in zip(args[0::2], args[1::2])))
+    mask = _criteria_mask(*args)
+    view = TypedRangeView.create(sum_range)
+
+    errors = view.values[mask & view.is_error]
+    if len(errors):
+        # return the first error in the summed cells
+        return errors[0]
 
-    ifs_count = len(args) // 2
-    indices = tuple(idx for idx, cnt in index_counts.items()
-                    if cnt == ifs_count)
-    return sum(_numerics(
-        (sum_range[r][c] for r, c in indices), keep_bools=True))
+    # sum the numbers (and bools), ignore strings and empty
+    numbers = mask & ~np.isnan(view.real)
+    total = np.sum(view.real[numbers])
+    if view.is_int[numbers].all():
+        return int(total)
+    return float(total)
 
 
 def sumproduct(*args):
@@ -669,7 +710,7 @@ def value(text):
         return VALUE_ERROR
 
 
-@excel_helper(cse_params=0, bool_params=3, number_params=2)
+@excel_helper(cse_params=0, bool_params=3, number_params=2, lazy_params=1)
 def vlookup(lookup_value, table_array, col_index_num, range_lookup=True):
     """ Vertical Lookup
 
@@ -693,7 +734,7 @@ def vlookup(lookup_value, table_array, col_index_num, range_lookup=True):
 
     result_idx = _match(
         lookup_value,
-        [row[0] for row in table_array],
+        _column(table_array, 0),
         match_type=bool(range_lookup)
     )
 
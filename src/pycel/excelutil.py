@@ -1,6 +1,8 @@
 import calendar
 import collections
 import datetime as dt
+import functools
+import itertools as it
 import math
 import operator
 import re
@@ -56,6 +58,9 @@ STAR_RE = re.compile(r'\*(?<!~)')
 MAX_COL = 16384
 MAX_ROW = 1048576
 
+# number of parsed criteria and wildcard matchers to keep, per type
+CRITERIA_CACHE_SIZE = 1024
+
 VALID_R1C1_RANGE_ITEM_COMBOS = {
     (0, 1, 0, 1),
     (1, 0, 1, 0),
@@ -891,6 +896,152 @@ class _ArrayFormulaContext:
 in_array_formula_context = _ArrayFormulaContext()
 
 
+class LazyVector:
+    """ One row or column of a `LazyRange`
+
+    Behaves like a tuple of values, but only evaluates the elements accessed
+    """
+
+    def __init__(self, length, get_value):
+        self._length = length
+        self._get_value = get_value
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return (self._get_value(i) for i in range(self._length))
+
+    def __getitem__(self, index):
+        # indexing a range() applies the tuple rules for negatives and bounds
+        index = range(self._length)[index]
+        if isinstance(index, range):
+            return tuple(self._get_value(i) for i in index)
+        return self._get_value(index)
+
+
+class LazyRange:
+    """ Rectangular range which only evaluates the cells that are accessed
+
+    Behaves like the tuple of row tuples which is usually passed for ranges.
+    Passed to library functions params marked as `lazy_params`.
+    """
+
+    def __init__(self, size, get_value):
+        """
+        :param size: `AddressSize` of the range
+        :param get_value: callable(row_idx, col_idx) -> evaluated cell value
+        """
+        self.size = size
+        self._get_value = get_value
+
+    def __len__(self):
+        return self.size.height
+
+    def __iter__(self):
+        return (self.row(i) for i in range(self.size.height))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self.row(i) for i in range(self.size.height)[index])
+        return self.row(index)
+
+    def row(self, row_idx):
+        """The row at `row_idx` as a `LazyVector`"""
+        row_idx = range(self.size.height)[row_idx]
+        return LazyVector(
+            self.size.width, lambda col_idx: self._get_value(row_idx, col_idx))
+
+    def column(self, col_idx):
+        """The column at `col_idx` as a `LazyVector`"""
+        col_idx = range(self.size.width)[col_idx]
+        return LazyVector(
+            self.size.height, lambda row_idx: self._get_value(row_idx, col_idx))
+
+
+class LookupVector(tuple):
+    """ A row or column of `RangeValues` with cached lookup structures
+
+    Built once per version of the range values, so the exact match index
+    and the approximate match sort keys are only computed once per range
+    change, no matter how many lookups are done against it.
+    """
+
+    @property
+    def index(self):
+        """Map of normalized (cmp_type, value) to first (1 based) position"""
+        index = self.__dict__.get('_index')
+        if index is None:
+            index = {}
+            for i, value in enumerate(self, 1):
+                if value not in ERROR_CODES:
+                    index.setdefault(ExcelCmp(value)[:2], i)
+            self._index = index
+        return index
+
+    def sort_keys(self, lookup_value):
+        """ Comparison keys for bisecting, as seen by `lookup_value`
+
+        :param lookup_value: `ExcelCmp` of the value being searched for,
+            empty cells take the type of this value
+        :return: tuple of (cmp_type, value) keys, and a tuple giving for
+            each key the (1 based) position of the last key at or before it
+            which has the same type as `lookup_value`, or 0 if none.
+        """
+        sort_keys = self.__dict__.setdefault('_sort_keys', {})
+        key = lookup_value.cmp_type, lookup_value.empty
+        if key not in sort_keys:
+            keys = tuple(ExcelCmp(v, empty=lookup_value)[:2] for v in self)
+            last_of_type = []
+            last = 0
+            for i, value in enumerate(self, 1):
+                if ExcelCmp(value).cmp_type == lookup_value.cmp_type:
+                    last = i
+                last_of_type.append(last)
+            sort_keys[key] = keys, tuple(last_of_type)
+        return sort_keys[key]
+
+
+class RangeValues(tuple):
+    """ The evaluated values of a range, as a tuple of row tuples
+
+    Rows and columns are provided as `LookupVector`s which cache their lookup
+    structures.  The compiler replaces the range's values whenever any cell
+    in the range changes, which also invalidates the cached structures.
+    """
+
+    def __reduce__(self):
+        # the lookup vectors are rebuilt on demand and are not serialized
+        return RangeValues, (tuple(self), )
+
+    def _vector(self, key, build):
+        vectors = self.__dict__.setdefault('_vectors', {})
+        if key not in vectors:
+            vectors[key] = LookupVector(build())
+        return vectors[key]
+
+    @property
+    def typed_view(self):
+        """The `TypedRangeView` of these values, for criteria masks"""
+        typed_view = self.__dict__.get('_typed_view')
+        if typed_view is None:
+            typed_view = self._typed_view = TypedRangeView.build(self)
+        return typed_view
+
+    def row(self, row_idx):
+        """The row at `row_idx` as a `LookupVector`"""
+        if row_idx < 0:
+            row_idx += len(self)
+        return self._vector(('row', row_idx), lambda: self[row_idx])
+
+    def column(self, col_idx):
+        """The column at `col_idx` as a `LookupVector`"""
+        if col_idx < 0 and self:
+            col_idx += len(self[0])
+        return self._vector(
+            ('col', col_idx), lambda: (row[col_idx] for row in self))
+
+
 def flatten(data, coerce=lambda x: x):
     """ flatten items, converting top level items as needed
 
@@ -1015,6 +1166,7 @@ def date_from_int(datestamp):
     return date.year, date.month, date.day
 
 
+@functools.lru_cache(maxsize=CRITERIA_CACHE_SIZE, typed=True)
 def build_wildcard_re(lookup_value):
     regex = QUESTION_MARK_RE.sub('.', STAR_RE.sub('.*', lookup_value))
     if regex != lookup_value:
@@ -1025,6 +1177,7 @@ def build_wildcard_re(lookup_value):
         return None
 
 
+@functools.lru_cache(maxsize=CRITERIA_CACHE_SIZE, typed=True)
 def criteria_parser(criteria):
     """
     General rules:
@@ -1102,6 +1255,152 @@ def find_corresponding_index_generator(rng, criteria):
             for c, item in enumerate(row) if check(item))
 
 
+class TypedRangeView(collections.namedtuple(
+        'TypedRangeView', 'values is_str lower number real is_int is_error')):
+    """ numpy arrays of a range's values, split by Excel type class
+
+    values: the values (object)
+    is_str: is a string (including error strings)
+    lower: lower case of strings, '' for non strings (object)
+    number: float of the value (including numeric strings), else nan
+    real: float of non string values (including bools), else nan
+    is_int: is an int (including bools)
+    is_error: is an error string
+    """
+
+    @classmethod
+    def create(cls, rng):
+        """The view of a range, cached if the range is `RangeValues`"""
+        if isinstance(rng, RangeValues):
+            return rng.typed_view
+        return cls.build(rng)
+
+    @classmethod
+    def build(cls, rng):
+        assert_list_like(rng)
+        rows = tuple(tuple(row) for row in rng)
+        shape = len(rows), len(rows[0]) if rows else 0
+        values = tuple(it.chain.from_iterable(rows))
+
+        # classify each value once, filling all the arrays
+        size = len(values)
+        is_str, is_int, is_error = ([False] * size for _ in range(3))
+        number, real = [math.nan] * size, [math.nan] * size
+        lower = [''] * size
+        for i, value in enumerate(values):
+            if isinstance(value, str):
+                is_str[i] = True
+                lower[i] = value.lower()
+                is_error[i] = value in ERROR_CODES
+                try:
+                    number[i] = float(value)
+                except ValueError:
+                    pass
+            else:
+                is_int[i] = isinstance(value, int)
+                try:
+                    number[i] = real[i] = float(value)
+                except (ValueError, TypeError):
+                    pass
+
+        def to_array(data, dtype):
+            if dtype == object:
+                array = np.empty(size, dtype=object)
+                array[:] = data
+            else:
+                array = np.array(data, dtype=dtype)
+            return array.reshape(shape)
+
+        return cls(
+            values=to_array(values, object),
+            is_str=to_array(is_str, bool),
+            lower=to_array(lower, object),
+            number=to_array(number, float),
+            real=to_array(real, float),
+            is_int=to_array(is_int, bool),
+            is_error=to_array(is_error, bool),
+        )
+
+
+@functools.lru_cache(maxsize=CRITERIA_CACHE_SIZE, typed=True)
+def criteria_mask_builder(criteria):
+    """ Build a function which evaluates criteria over a `TypedRangeView`
+
+    The masks match `criteria_parser` for each cell, but are computed with
+    numpy over the whole range at once.
+
+    :param criteria: criteria as used by `criteria_parser`
+    :return: function(TypedRangeView) -> numpy boolean array
+    """
+
+    if is_number(criteria):
+        # numeric equals comparision
+        criteria = coerce_to_number(criteria)
+
+        def mask(view):
+            return view.number == criteria
+
+    elif isinstance(criteria, str):
+        match = OPERATORS_RE.match(criteria)
+        criteria_operator = match.group('oper') or ''
+        value = match.group('value')
+        op = OPERATORS[criteria_operator]
+
+        if op == operator.eq:
+
+            if is_number(value):
+                return criteria_mask_builder(value)
+
+            check = build_wildcard_re(value)
+            if check is not None:
+                def mask(view):
+                    return view.is_str & np.fromiter(
+                        (check(x) for x in view.lower.flat), dtype=bool,
+                        count=view.lower.size).reshape(view.lower.shape)
+                return mask
+
+        if is_number(value):
+            value = coerce_to_number(value)
+
+            def mask(view):
+                # string always compare False unless '!='
+                with np.errstate(invalid='ignore'):
+                    return np.where(
+                        view.is_str, op == operator.ne, op(view.real, value))
+        else:
+            value = value.lower()
+
+            def mask(view):
+                # non string always compare False unless '!='
+                return np.where(view.is_str,
+                                op(view.lower, value).astype(bool),
+                                op == operator.ne)
+
+    else:
+        raise ValueError("Couldn't parse criteria: {}".format(criteria))
+
+    return mask
+
+
+def criteria_cache_info():
+    """ Statistics for the parsed criteria and wildcard matcher caches
+
+    :return: dict of cache name to dict of hits, misses, hit_rate, size
+    """
+    def info(func):
+        stats = func.cache_info()
+        lookups = stats.hits + stats.misses
+        return dict(
+            hits=stats.hits,
+            misses=stats.misses,
+            hit_rate=stats.hits / lookups if lookups else 0.0,
+            size=stats.currsize,
+        )
+
+    return {func.__name__: info(func) for func in (
+        criteria_parser, criteria_mask_builder, build_wildcard_re)}
+
+
 def list_like(data):
     return (not isinstance(data, (str, AddressRange, AddressCell)) and
             isinstance(data, collections.abc.Iterable))
@@ -2,22 +2,42 @@
     ExcelComWrapper : Must be run on Windows as it requires a COM link
                       to an Excel instance.
     ExcelOpxWrapper : Can be run anywhere but only with post 2010 Excel formats
+    ExcelXlsxWrapper : Streams the xlsx xml once, without openpyxl's workbook
 """
 
 import abc
 import collections
+import functools
+import io
+import itertools
 import os
+import posixpath
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from unittest import mock
+from xml.etree.ElementTree import fromstring, iterparse
 
 from openpyxl import load_workbook
 from openpyxl.cell.cell import Cell, MergedCell
 from openpyxl.cell.read_only import EMPTY_CELL
-from openpyxl.utils import datetime as opxl_dt
+from openpyxl.formula.translate import Translator
+from openpyxl.reader.strings import read_string_table
+from openpyxl.utils import (
+    coordinate_to_tuple,
+    datetime as opxl_dt,
+    get_column_letter,
+    range_boundaries,
+)
+from openpyxl.workbook.defined_name import DefinedName, DefinedNameList
+from openpyxl.worksheet.table import Table
+from openpyxl.xml.constants import REL_NS, SHEET_MAIN_NS
 from pycel.excelutil import AddressCell, AddressRange, flatten
 
 ARRAY_FORMULA_NAME = '=CSE_INDEX'
 ARRAY_FORMULA_FORMAT = '{}(%s,%s,%s,%s,%s)'.format(ARRAY_FORMULA_NAME)
 
+TableAndSheet = collections.namedtuple('TableAndSheet', 'table, sheet_name')
+
 
 class ExcelWrapper:
     __metaclass__ = abc.ABCMeta
@@ -40,6 +60,20 @@ class ExcelWrapper:
     def get_active_sheet_name(self):
         """"""
 
+    def get_shared_formula(self, address):
+        """ Return the master address and formula of a shared formula cell
+
+        Wrappers which can not see the shared formulas return None
+        """
+        return None
+
+    def get_calc_chain(self):
+        """ Return the formula cell addresses in Excel's calculation order
+
+        Wrappers which can not see the calc chain return an empty tuple
+        """
+        return ()
+
     def get_formula_from_range(self, address):
         if not isinstance(address, (AddressRange, AddressCell)):
             address = AddressRange(address)
@@ -137,18 +171,58 @@ class _OpxCell(_OpxRange):
             cls, address, cls.cell_to_formula(cell), cell_dataonly.value)
 
 
+class _OpxCachedValues:
+    """ The cached values of a data_only worksheet, indexed by (row, column)
+
+    Only non empty cells are stored.  The extents are those the data_only
+    worksheet reports, which are used to bound unbounded ranges.
+    """
+
+    def __init__(self, worksheet):
+        self.title = worksheet.title
+        self.values = {
+            (cell.row, cell.column): cell.value
+            for row in worksheet.iter_rows() for cell in row
+            if cell.value is not None
+        }
+        self.max_row = worksheet.max_row
+        self.max_column = worksheet.max_column
+
+    def value_cell(self, row, column):
+        value = self.values.get((row, column))
+        if value is None:
+            return EMPTY_CELL
+        return _XlsxCell(value, row, column, self)
+
+
 class ExcelOpxWrapper(ExcelWrapper):
     """ OpenPyXl implementation for ExcelWrapper interface """
 
+    WORKBOOK_REL_TYPE = REL_NS + '/officeDocument'
+    CALC_CHAIN_REL_TYPE = REL_NS + '/calcChain'
+
     def __init__(self, filename, app=None):
+        """
+        :param filename: path to the workbook, or the workbook as bytes or
+            a binary file object, which is read once into memory
+        """
         super(ExcelWrapper, self).__init__()
 
-        self.filename = os.path.abspath(filename)
+        # a workbook given in memory is kept there, it is not read again
+        if isinstance(filename, (bytes, bytearray)):
+            self.contents, filename = bytes(filename), None
+        elif hasattr(filename, 'read'):
+            self.contents = filename.read()
+            filename = getattr(filename, 'name', None)
+        else:
+            self.contents = None
+        self.filename = filename and os.path.abspath(filename)
         self._defined_names = None
         self._tables = None
         self._table_refs = {}
         self.workbook = None
-        self.workbook_dataonly = None
+        self.cached_values = None
+        self.calc_chain = None
 
     @property
     def defined_names(self):
@@ -170,8 +244,6 @@ class ExcelOpxWrapper(ExcelWrapper):
         """
         # table names are case insensitive
         if self._tables is None:
-            TableAndSheet = collections.namedtuple(
-                'TableAndSheet', 'table, sheet_name')
             self._tables = {
                 t.name.lower(): TableAndSheet(t, ws.title)
                 for ws in self.workbook for t in ws._tables}
@@ -189,10 +261,26 @@ class ExcelOpxWrapper(ExcelWrapper):
 
         return self._table_refs.get(address)
 
+    @property
+    def source(self):
+        """The filename, or a file object of the workbook held in memory"""
+        if self.contents is None:
+            return self.filename
+        return io.BytesIO(self.contents)
+
     def connect(self):
-        self.workbook = load_workbook(self.filename)
-        self.workbook_dataonly = load_workbook(
-            self.filename, data_only=True, read_only=True)
+        self.workbook = load_workbook(self.source)
+
+        # Random access into a read_only worksheet re-parses the sheet xml,
+        # so read each data_only sheet once and index the cached values
+        workbook_dataonly = load_workbook(
+            self.source, data_only=True, read_only=True)
+        with mock.patch('openpyxl.worksheet._reader.from_excel',
+                        self.from_excel):
+            # work around type coercion to datetime that causes some issues
+            self.cached_values = collections.OrderedDict(
+                (ws.title, _OpxCachedValues(ws)) for ws in workbook_dataonly)
+        workbook_dataonly.close()
 
         # expand array formulas
         for ws in self.workbook:
@@ -210,10 +298,60 @@ class ExcelOpxWrapper(ExcelWrapper):
                             ws[addr.coordinate] = ARRAY_FORMULA_FORMAT % (
                                 formula[1:], i, j, *ref_addr.size)
 
+    @staticmethod
+    def _rels(archive, part):
+        """Map of relationship id to (type, target part) for a part"""
+        folder, name = posixpath.split(part)
+        rels_part = posixpath.join(folder, '_rels', name + '.rels')
+        if rels_part not in archive.namelist():
+            return {}
+
+        rels = {}
+        for rel in fromstring(archive.read(rels_part)):
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            rels[rel.get('Id')] = rel.get('Type'), target
+        return rels
+
+    @classmethod
+    def _workbook_part(cls, archive):
+        """The name of the workbook part in the xlsx archive"""
+        return next(
+            (target for rel_type, target in cls._rels(archive, '').values()
+             if rel_type == cls.WORKBOOK_REL_TYPE), 'xl/workbook.xml')
+
+    def _read_calc_chain(self, archive, workbook_rels, sheet_ids):
+        """The formula cells, in the order Excel last calculated them"""
+        part = next((target for rel_type, target in workbook_rels.values()
+                     if rel_type == self.CALC_CHAIN_REL_TYPE), None)
+        if part is None:
+            return
+
+        # the sheet id is only given when it changes
+        sheet = None
+        for cell in fromstring(archive.read(part)).iter(_tag('c')):
+            sheet = sheet_ids.get(cell.get('i'), sheet)
+            if sheet is not None:
+                yield AddressCell(cell.get('r'), sheet=sheet)
+
+    def get_calc_chain(self):
+        """The calc chain, read from the xlsx the first time it is used"""
+        if self.calc_chain is None:
+            with zipfile.ZipFile(self.source) as archive:
+                workbook_part = self._workbook_part(archive)
+                sheet_ids = {
+                    sheet_xml.get('sheetId'): sheet_xml.get('name')
+                    for sheet_xml in fromstring(archive.read(
+                        workbook_part)).iter(_tag('sheet'))}
+                self.calc_chain = tuple(self._read_calc_chain(
+                    archive, self._rels(archive, workbook_part), sheet_ids))
+        return self.calc_chain
+
     def set_sheet(self, s):
         self.workbook.active = self.workbook.index(self.workbook[s])
-        self.workbook_dataonly.active = self.workbook_dataonly.index(
-            self.workbook_dataonly[s])
         return self.workbook.active
 
     @staticmethod
@@ -230,45 +368,406 @@ class ExcelOpxWrapper(ExcelWrapper):
 
         if address.has_sheet:
             sheet = self.workbook[address.sheet]
-            sheet_dataonly = self.workbook_dataonly[address.sheet]
         else:
             sheet = self.workbook.active
-            sheet_dataonly = self.workbook_dataonly.active
-
-        with mock.patch('openpyxl.worksheet._reader.from_excel',
-                        self.from_excel):
-            # work around type coercion to datetime that causes some issues
-
-            if address.is_range and not address.is_bounded_range:
-                # bound the address range to the data in the spreadsheet
-                address = address & AddressRange(
-                    (1, 1, sheet_dataonly.max_column, sheet_dataonly.max_row),
-                    sheet=address.sheet)
-
-            cells = sheet[address.coordinate]
-            if isinstance(cells, (Cell, MergedCell)):
-                cell = cells
-                cell_dataonly = sheet_dataonly[address.coordinate]
-                return _OpxCell(cell, cell_dataonly, address)
+        cached_values = self.cached_values[sheet.title]
 
-            else:
-                cells_dataonly = sheet_dataonly[address.coordinate]
+        if address.is_range and not address.is_bounded_range:
+            # bound the address range to the data in the spreadsheet
+            address = address & AddressRange(
+                (1, 1, cached_values.max_column, cached_values.max_row),
+                sheet=address.sheet)
 
-                if len(cells) != len(cells_dataonly):
-                    # The read_only version of openpyxl worksheet has the
-                    # somewhat annoying property of not giving empty rows at the
-                    # end.  Which is not the same behavior as the non-readonly
-                    # version.  So we need to align the data here by adding
-                    # empty rows.
-                    empty_row = (EMPTY_CELL, ) * len(cells[0])
-                    empty_rows = (empty_row, ) * (
-                        len(cells) - len(cells_dataonly))
-                    cells_dataonly += empty_rows
+        cells = sheet[address.coordinate]
+        if isinstance(cells, (Cell, MergedCell)):
+            return _OpxCell(cells, cached_values.value_cell(
+                address.row, address.col_idx), address)
 
-                return _OpxRange(cells, cells_dataonly, address)
+        else:
+            rows = range(address.start.row, address.end.row + 1)
+            cols = range(address.start.col_idx, address.end.col_idx + 1)
+            cells_dataonly = tuple(
+                tuple(cached_values.value_cell(r, c) for c in cols)
+                for r in rows)
+            return _OpxRange(cells, cells_dataonly, address)
 
     def get_used_range(self):
         return self.workbook.active.iter_rows()
 
     def get_active_sheet_name(self):
         return self.workbook.active.title
+
+
+def _tag(name, namespace=SHEET_MAIN_NS):
+    return '{%s}%s' % (namespace, name)
+
+
+class _XlsxCell:
+    """ The minimal cell api used by `_OpxRange` and the compiler """
+
+    __slots__ = ('value', 'row', 'col_idx', 'parent')
+
+    def __init__(self, value, row, col_idx, parent):
+        self.value = value
+        self.row = row
+        self.col_idx = col_idx
+        self.parent = parent
+
+    @property
+    def coordinate(self):
+        return '{}{}'.format(get_column_letter(self.col_idx), self.row)
+
+
+class _XlsxSheet:
+    """ The formulas and values of a worksheet, from a single pass of its xml
+
+    Only non empty cells are stored.  `formulas` holds the formula for
+    formula cells (as openpyxl would show it in a workbook with formulas) and
+    `values` holds the values (as openpyxl would show them in a data_only
+    workbook, ie: the cached values for formula cells).  `shared` maps the
+    cells of each shared formula to the cell holding its master formula.
+    """
+
+    DIMENSION_TAG = _tag('dimension')
+    ROW_TAG = _tag('row')
+    CELL_TAG = _tag('c')
+    VALUE_TAG = _tag('v')
+    FORMULA_TAG = _tag('f')
+    INLINE_STRING_TAG = _tag('is')
+    TEXT_TAG = _tag('t')
+
+    def __init__(self, title, loader=None):
+        self.title = title
+        self.formulas = {}
+        self.values = {}
+        self.shared = {}
+        self._tables = []
+
+        # when loading lazily, called to parse the sheet on first use
+        self._loader = loader
+
+        # extents of the cells in the xml, and the size from the dimension
+        self.min_row = self.min_column = 1
+        self.max_row = self.max_column = 1
+        self.dimension_size = None
+
+    def parse(self, xml_source, shared_strings):
+        """Read the cells from the sheet xml, in one streaming pass"""
+        shared_formulas = {}
+        array_formulas = []
+        row = column = 0
+        min_row = min_col = None
+        max_row = max_col = 0
+
+        for event, element in iterparse(xml_source, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == self.ROW_TAG:
+                    row = int(element.get('r', row + 1))
+                    column = 0
+
+                elif tag == self.DIMENSION_TAG:
+                    self.dimension_size = range_boundaries(
+                        element.get('ref'))[2:]
+                continue
+
+            if tag == self.CELL_TAG:
+                coordinate = element.get('r')
+                if coordinate:
+                    row, column = coordinate_to_tuple(coordinate)
+                else:
+                    column += 1
+                    coordinate = '{}{}'.format(get_column_letter(column), row)
+                key = row, column
+
+                min_row = row if min_row is None else min(min_row, row)
+                min_col = column if min_col is None else min(min_col, column)
+                max_row = max(max_row, row)
+                max_col = max(max_col, column)
+
+                value = self._cell_value(element, shared_strings)
+                if value is not None:
+                    self.values[key] = value
+
+                formula = element.find(self.FORMULA_TAG)
+                if formula is not None:
+                    self.formulas[key] = self._cell_formula(
+                        formula, key, coordinate, shared_formulas,
+                        array_formulas)
+                element.clear()
+
+            elif tag == self.ROW_TAG:
+                element.clear()
+
+        if min_row is None:
+            # like openpyxl, an empty sheet has a single empty cell
+            min_row = min_col = max_row = max_col = 1
+        self.min_row, self.min_column = min_row, min_col
+        self.max_row, self.max_column = max_row, max_col
+
+        # expand array formulas to every cell in the array
+        for coordinate, ref in array_formulas:
+            ref_addr = AddressRange(ref)
+            if isinstance(ref_addr, AddressRange):
+                formula = self.formulas[coordinate_to_tuple(coordinate)]
+                for i, row in enumerate(ref_addr.rows, start=1):
+                    for j, addr in enumerate(row, start=1):
+                        self.formulas[addr.row, addr.col_idx] = \
+                            ARRAY_FORMULA_FORMAT % (
+                                formula[1:], i, j, *ref_addr.size)
+
+    def _cell_value(self, element, shared_strings):
+        data_type = element.get('t', 'n')
+        if data_type == 'inlineStr':
+            inline = element.find(self.INLINE_STRING_TAG)
+            if inline is None:
+                return None
+            return ''.join(t.text or '' for t in inline.iter(self.TEXT_TAG))
+
+        value = element.findtext(self.VALUE_TAG, None) or None
+        if value is None:
+            return None
+        elif data_type == 'n':
+            if '.' in value or 'E' in value or 'e' in value:
+                return float(value)
+            return int(value)
+        elif data_type == 's':
+            return shared_strings[int(value)]
+        elif data_type == 'b':
+            return bool(int(value))
+        else:
+            # str, e(rror) and d(ate) are kept as strings
+            return value
+
+    def _cell_formula(self, formula, key, coordinate, shared_formulas,
+                      array_formulas):
+        value = '=' + (formula.text or '')
+        formula_type = formula.get('t')
+        if formula_type == 'array':
+            array_formulas.append((coordinate, formula.get('ref')))
+
+        elif formula_type == 'shared':
+            idx = formula.get('si')
+            if idx in shared_formulas:
+                translator, master_key = shared_formulas[idx]
+                value = translator.translate_formula(coordinate)
+                self.shared[key] = master_key
+            elif value != '=':
+                shared_formulas[idx] = Translator(value, coordinate), key
+                self.shared[key] = key
+
+        return value
+
+    @property
+    def is_loaded(self):
+        return self._loader is None
+
+    def load(self):
+        """Parse the sheet, if that was deferred until first use"""
+        loader, self._loader = self._loader, None
+        if loader is not None:
+            loader(self)
+
+    @property
+    def size(self):
+        """max column and row, as a data_only openpyxl sheet would see it"""
+        self.load()
+        return self.dimension_size or (self.max_column, self.max_row)
+
+    def cell(self, row, column):
+        if self._loader is not None:
+            self.load()
+        key = row, column
+        value = self.formulas.get(key, self.values.get(key))
+        return _XlsxCell(value, row, column, self)
+
+    def value_cell(self, row, column):
+        if self._loader is not None:
+            self.load()
+        return _XlsxCell(self.values.get((row, column)), row, column, self)
+
+    def iter_rows(self):
+        self.load()
+        for row in range(self.min_row, self.max_row + 1):
+            yield tuple(self.cell(row, col) for col in range(
+                self.min_column, self.max_column + 1))
+
+
+def _read_shared_strings(archive, part):
+    if part is None:
+        return []
+    with archive.open(part) as xml_source:
+        return read_string_table(xml_source)
+
+
+def _parse_worksheet(archive, part, sheet, shared_strings):
+    with archive.open(part) as xml_source:
+        sheet.parse(xml_source, shared_strings)
+    return sheet
+
+
+# shared strings, read once by each process of a parse pool
+_worker_shared_strings = {}
+
+
+def _parse_worksheet_in_worker(filename, strings_part, part, title):
+    """Parse a worksheet part into a (picklable) `_XlsxSheet`"""
+    with zipfile.ZipFile(filename) as archive:
+        key = filename, strings_part
+        if key not in _worker_shared_strings:
+            _worker_shared_strings[key] = _read_shared_strings(
+                archive, strings_part)
+        return _parse_worksheet(
+            archive, part, _XlsxSheet(title), _worker_shared_strings[key])
+
+
+class _XlsxWorkbook:
+    """ The parts of the openpyxl Workbook api used with an ExcelWrapper """
+
+    def __init__(self, sheets, active_index, defined_names):
+        self.sheets = collections.OrderedDict(
+            (sheet.title, sheet) for sheet in sheets)
+        self.active = sheets[active_index] if sheets else None
+        self.defined_names = DefinedNameList(definedName=defined_names)
+
+    def __iter__(self):
+        return iter(self.sheets.values())
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self.sheets
+
+    def __getitem__(self, sheet_name):
+        return self.sheets[sheet_name]
+
+
+class ExcelXlsxWrapper(ExcelOpxWrapper):
+    """ ExcelWrapper which reads the xlsx xml directly
+
+    Each worksheet is streamed once with `iterparse`, collecting the
+    formulas and cached values together.  `ExcelOpxWrapper` instead loads
+    the workbook twice (formulas and data_only) into openpyxl's cell objects.
+
+    With `lazy_sheets`, `connect` only reads the sheet index, defined names
+    and tables, and each worksheet is parsed the first time it is used.
+    Otherwise, with `parse_workers`, the worksheets are parsed concurrently
+    in a pool of that many processes.  (A workbook given as bytes or a file
+    object is parsed in process, rather than copied to each worker)
+    """
+
+    WORKSHEET_REL_TYPE = REL_NS + '/worksheet'
+    SHARED_STRINGS_REL_TYPE = REL_NS + '/sharedStrings'
+    TABLE_REL_TYPE = REL_NS + '/table'
+
+    def __init__(self, filename, app=None, lazy_sheets=False,
+                 parse_workers=None):
+        super().__init__(filename, app=app)
+        self.lazy_sheets = lazy_sheets
+        self.parse_workers = parse_workers
+
+    def connect(self):
+        with zipfile.ZipFile(self.source) as archive:
+            workbook_part = self._workbook_part(archive)
+            workbook_rels = self._rels(archive, workbook_part)
+            workbook_xml = fromstring(archive.read(workbook_part))
+
+            strings_part = next(
+                (target for rel_type, target in workbook_rels.values()
+                 if rel_type == self.SHARED_STRINGS_REL_TYPE), None)
+            shared_strings = _read_shared_strings(archive, strings_part)
+
+            titles, parts, tables, sheet_ids = [], [], [], {}
+            for sheet_xml in workbook_xml.iter(_tag('sheet')):
+                rel_id = sheet_xml.get(_tag('id', REL_NS))
+                rel_type, part = workbook_rels[rel_id]
+                if rel_type != self.WORKSHEET_REL_TYPE:
+                    continue  # pragma: no cover
+
+                sheet_ids[sheet_xml.get('sheetId')] = sheet_xml.get('name')
+                titles.append(sheet_xml.get('name'))
+                parts.append(part)
+                tables.append([
+                    Table.from_tree(fromstring(archive.read(target)))
+                    for rel_type, target in self._rels(archive, part).values()
+                    if rel_type == self.TABLE_REL_TYPE
+                ])
+
+            if self.lazy_sheets:
+                sheets = [
+                    _XlsxSheet(title, functools.partial(
+                        self._load_sheet, part, shared_strings))
+                    for title, part in zip(titles, parts)]
+
+            elif self.parse_workers and len(parts) > 1 and \
+                    self.contents is None:
+                with ProcessPoolExecutor(self.parse_workers) as executor:
+                    sheets = list(executor.map(
+                        _parse_worksheet_in_worker,
+                        itertools.repeat(self.filename),
+                        itertools.repeat(strings_part), parts, titles))
+            else:
+                sheets = [
+                    _parse_worksheet(
+                        archive, part, _XlsxSheet(title), shared_strings)
+                    for title, part in zip(titles, parts)]
+
+            self.calc_chain = tuple(self._read_calc_chain(
+                archive, workbook_rels, sheet_ids))
+
+        for sheet, sheet_tables in zip(sheets, tables):
+            sheet._tables = sheet_tables
+
+        defined_names = [
+            DefinedName.from_tree(defined_name)
+            for defined_name in workbook_xml.iter(_tag('definedName'))]
+
+        view = workbook_xml.find('{0}bookViews/{0}workbookView'.format(
+            '{%s}' % SHEET_MAIN_NS))
+        active_index = int(view.get('activeTab', 0)) if view is not None else 0
+        self.workbook = _XlsxWorkbook(
+            sheets, min(active_index, len(sheets) - 1), defined_names)
+
+    def _load_sheet(self, part, shared_strings, sheet):
+        with zipfile.ZipFile(self.source) as archive:
+            _parse_worksheet(archive, part, sheet, shared_strings)
+
+    def set_sheet(self, s):
+        self.workbook.active = self.workbook[s]
+        return self.workbook.active
+
+    def get_shared_formula(self, address):
+        sheet = self.workbook[address.sheet]
+        sheet.load()
+        master_key = sheet.shared.get((address.row, address.col_idx))
+        if master_key is None:
+            return None
+
+        row, col = master_key
+        master_address = AddressCell((col, row, col, row), sheet=sheet.title)
+        return master_address, sheet.formulas[master_key]
+
+    def get_range(self, address):
+        if not isinstance(address, (AddressRange, AddressCell)):
+            address = AddressRange(address)
+
+        if address.has_sheet:
+            sheet = self.workbook[address.sheet]
+        else:
+            sheet = self.workbook.active
+
+        if not address.is_range:
+            return _OpxCell(
+                sheet.cell(address.row, address.col_idx),
+                sheet.value_cell(address.row, address.col_idx),
+                address)
+
+        if not address.is_bounded_range:
+            # bound the address range to the data in the spreadsheet
+            address = address & AddressRange(
+                (1, 1, *sheet.size), sheet=address.sheet)
+
+        rows = range(address.start.row, address.end.row + 1)
+        cols = range(address.start.col_idx, address.end.col_idx + 1)
+        cells = tuple(tuple(sheet.cell(r, c) for c in cols) for r in rows)
+        cells_dataonly = tuple(
+            tuple(sheet.value_cell(r, c) for c in cols) for r in rows)
+        return _OpxRange(cells, cells_dataonly, address)
@@ -17,7 +17,7 @@ ALL_ARG_INDICES = frozenset(range(512))
 
 
 def excel_helper(cse_params=None, bool_params=None,
-                 err_str_params=-1, number_params=None):
+                 err_str_params=-1, number_params=None, lazy_params=None):
     """ Decorator to annotate a function with info on how to process params
 
     All parameters are encoded as:
@@ -33,6 +33,7 @@ def excel_helper(cse_params=None, bool_params=None,
     :param bool_params: params to coerce to bools
     :param err_str_params: params to check for error strings
     :param number_params: params to coerce to numbers
+    :param lazy_params: range params which can be passed as a `LazyRange`
     :return: decorator
     """
     def mark(f):
@@ -41,6 +42,7 @@ def excel_helper(cse_params=None, bool_params=None,
             bool_params=bool_params,
             err_str_params=err_str_params,
             number_params=number_params,
+            lazy_params=lazy_params,
         ))
         return f
     return mark
@@ -77,6 +79,16 @@ def apply_meta(func, meta=None):
     return func, meta
 
 
+def is_lazy_param(func, param_idx):
+    """Can this (excelized) function accept a `LazyRange` for this param?"""
+    meta = getattr(func, FUNC_META, None)
+    lazy_params = meta and meta.get('lazy_params')
+    if lazy_params is None:
+        return False
+    return lazy_params == -1 or param_idx in convert_params_indices(
+        func, lazy_params)
+
+
 def convert_params_indices(f, param_indices):
     """Given parameter indices, return a set of parameter indices to process
 
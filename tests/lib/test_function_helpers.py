@@ -11,6 +11,7 @@ from pycel.lib.function_helpers import (
     error_string_wrapper,
     excel_helper,
     excel_math_func,
+    is_lazy_param,
     load_functions,
 )
 
@@ -112,3 +113,20 @@ def test_load_functions():
     missing = load_functions(['log'], namespace, modules)
     assert not missing
     assert namespace['log'](DIV0) == DIV0
+
+
+@pytest.mark.parametrize(
+    'lazy_params, param_idx, expected', (
+        (None, 0, False),
+        (-1, 3, True),
+        (1, 0, False),
+        (1, 1, True),
+        ((0, 2), 2, True),
+        ((0, 2), 1, False),
+    )
+)
+def test_is_lazy_param(lazy_params, param_idx, expected):
+    func = excel_helper(lazy_params=lazy_params)(lambda x, y, z: x)
+    assert is_lazy_param(func, param_idx) == expected
+    assert is_lazy_param(apply_meta(func)[0], param_idx) == expected
+    assert not is_lazy_param(lambda x: x, 0)
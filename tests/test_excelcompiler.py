@@ -1,19 +1,43 @@
+import datetime
+import gc
+import io
 import json
 import os
+import pickle
 import shutil
+import weakref
 from unittest import mock
 
+import numpy as np
+import openpyxl
 import pytest
-from pycel.excelcompiler import _Cell, _CellRange, ExcelCompiler
-from pycel.excelformula import FormulaParserError, UnknownFunction
+from pycel.excelcompiler import (
+    _Cell,
+    _CellRange,
+    _formula_templates,
+    CompiledCache,
+    ExcelCompiler,
+)
+from pycel.excelformula import (
+    ExcelFormula,
+    FormulaCache,
+    FormulaParserError,
+    UnknownFunction,
+)
 from pycel.excelutil import (
     AddressCell,
     AddressRange,
     flatten,
     list_like,
     NULL_ERROR,
+    RangeValues,
 )
-from pycel.excelwrapper import ExcelWrapper
+from pycel.excelwrapper import (
+    ExcelOpxWrapper,
+    ExcelWrapper,
+    ExcelXlsxWrapper,
+)
+from ruamel.yaml import YAML
 
 
 # ::TODO:: need some rectangular ranges for testing
@@ -73,6 +97,382 @@ def test_round_trip_through_json_yaml_and_pickle(
     assert -0.00331 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
 
 
+def test_round_trip_through_binary(excel_compiler):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.extra_data = {1: 3}
+    excel_compiler.to_file(file_types=('bin', 'yml'))
+    binary_name = excel_compiler.filename + '.bin'
+
+    # the graph and compiled code are loaded, nothing is parsed or compiled
+    with mock.patch.object(ExcelFormula, '_parse_to_rpn') as parse, \
+            mock.patch.object(ExcelFormula, '_compile_python_ast') as comp:
+        loaded = ExcelCompiler.from_file(binary_name)
+        assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+    assert not parse.called
+    assert not comp.called
+
+    assert loaded.filename == excel_compiler.filename
+    assert loaded.hash_matches
+    assert loaded.extra_data == {1: 3}
+    assert set(loaded.cell_map) == set(excel_compiler.cell_map)
+    assert {(str(a.address), str(b.address))
+            for a, b in loaded.dep_graph.edges()} == {
+        (str(a.address), str(b.address))
+        for a, b in excel_compiler.dep_graph.edges()}
+
+    loaded.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+    # formulas which fail to compile are saved without code
+    with mock.patch.object(ExcelFormula, 'marshalled_python',
+                           new_callable=mock.PropertyMock) as marshalled:
+        marshalled.return_value = None
+        excel_compiler.to_file(file_types=('bin', ))
+    loaded = ExcelCompiler.from_file(binary_name)
+    assert loaded.cell_map['Sheet1!D1'].formula._marshalled_python is None
+    excel_compiler.to_file(file_types=('bin', ))
+
+    # code from another python version is compiled again
+    with open(binary_name, 'rb') as f:
+        data = bytearray(f.read())
+    data[10:14] = b'\0\0\0\0'
+    with open(binary_name, 'wb') as f:
+        f.write(data)
+    loaded = ExcelCompiler.from_file(binary_name)
+    assert loaded.cell_map['Sheet1!D1'].formula._marshalled_python is None
+    assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+    data[8] += 1
+    with open(binary_name, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError, match='Unsupported binary format'):
+        ExcelCompiler.from_file(binary_name)
+
+    data[0] += 1
+    with open(binary_name, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError, match='Not a pycel binary file'):
+        ExcelCompiler.from_file(binary_name)
+
+
+def test_binary_use_mmap(excel_compiler):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.to_file(file_types=('bin', ))
+    mapped = ExcelCompiler.from_file(
+        excel_compiler.filename + '.bin', use_mmap=True)
+
+    # cells are only built when used
+    assert len(mapped.cell_map) == 0
+    assert 'Sheet1!A1' in mapped.cell_map
+    assert 'Sheet1!Z99' not in mapped.cell_map
+    assert mapped.cell_map.get('Sheet1!Z99') is None
+    assert len(mapped.cell_map) == 0
+
+    assert mapped.cell_map['Sheet1!A1'].value == 1
+    assert -0.02286 == round(mapped.evaluate('Sheet1!D1'), 5)
+    assert 'Sheet1!A1' in dict(mapped.cell_map)
+    assert 'Sheet2!A1' not in dict(mapped.cell_map)
+
+    def edges(compiler):
+        return {(str(a.address), str(b.address))
+                for a, b in compiler.dep_graph.edges()}
+
+    built = set(mapped.cell_map)
+    assert edges(mapped) == {edge for edge in edges(excel_compiler)
+                             if set(edge) <= built}
+
+    mapped.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(mapped.evaluate('Sheet1!D1'), 5)
+
+
+@pytest.mark.parametrize('compression', ('zlib', 'lzma'))
+def test_round_trip_through_compressed(excel_compiler, compression):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.evaluate('sref!A1')
+    excel_compiler.extra_data = {'a': 3}
+    excel_compiler.to_file(
+        file_types=('zmodel', 'yml'), compression=compression)
+    filename = excel_compiler.filename + '.zmodel'
+    assert os.path.getsize(filename) < os.path.getsize(
+        excel_compiler.filename + '.yml')
+
+    loaded = ExcelCompiler.from_file(filename)
+    assert loaded.excel is None
+    assert loaded.extra_data == {'a': 3}
+    assert set(loaded.cell_map) == set(excel_compiler.cell_map)
+    assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+    loaded.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+    # only the sheets used are decompressed
+    lazy = ExcelCompiler.from_file(filename, lazy=True)
+    cell_map = lazy.excel.cell_map
+    assert set(cell_map.sections) == {'Sheet1', 'sref'}
+    assert -0.02286 == round(lazy.evaluate('Sheet1!D1'), 5)
+    assert set(cell_map.sheets) == {'Sheet1'}
+    assert cell_map.get('Sheet2!A1') is None
+    assert set(cell_map.sheets) == {'Sheet1'}
+    assert len(cell_map) == len(
+        [cell for cell in excel_compiler.cell_map.values() if cell.serialize])
+    assert set(cell_map.sheets) == {'Sheet1', 'sref'}
+    assert 'sref!A1' in set(cell_map)
+
+    with pytest.raises(ValueError, match='Unknown compression'):
+        excel_compiler.to_file(file_types=('zmodel', ), compression='gzip')
+
+    with open(filename, 'rb') as f:
+        data = bytearray(f.read())
+    data[8] += 1
+    with open(filename, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError, match='Unsupported compressed format'):
+        ExcelCompiler.from_file(filename)
+
+    data[0] += 1
+    with open(filename, 'wb') as f:
+        f.write(data)
+    with pytest.raises(ValueError, match='Not a pycel compressed file'):
+        ExcelCompiler.from_file(filename)
+
+
+@pytest.mark.parametrize('file_type', ('zmodel', 'bin', 'pkl'))
+def test_unmarshallable_values(excel_compiler, file_type):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.evaluate('Sheet2!A1')
+    excel_compiler.extra_data = {'date': datetime.date(2020, 1, 2)}
+    excel_compiler.cell_map['Sheet2!A1'].value = datetime.date(2020, 1, 3)
+    filename = excel_compiler.filename + '.' + file_type
+    excel_compiler.to_file(filename)
+
+    loaded = ExcelCompiler.from_file(filename)
+    assert loaded.extra_data == {'date': datetime.date(2020, 1, 2)}
+    assert loaded.cell_map['Sheet2!A1'].value == datetime.date(2020, 1, 3)
+    assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+
+@pytest.mark.parametrize('file_type', ('yml', 'json', 'bin', 'zmodel'))
+def test_lazy_from_file(excel_compiler, file_type):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.to_file(file_types=(file_type, ))
+    filename = excel_compiler.filename + '.' + file_type
+
+    lazy = ExcelCompiler.from_file(filename, lazy=True)
+    assert len(lazy.cell_map) == 0
+    assert lazy.evaluate('Sheet1!B1') == 6
+    assert 0 < len(lazy.cell_map) < len(excel_compiler.cell_map)
+    assert 'Sheet1!D1' not in dict(lazy.cell_map)
+
+    assert -0.02286 == round(lazy.evaluate('Sheet1!D1'), 5)
+    lazy.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(lazy.evaluate('Sheet1!D1'), 5)
+
+    if file_type in ('yml', 'json'):
+        # text file line numbers are the same as for a full load
+        formula = lazy.cell_map['Sheet1!D1'].formula
+        expected = ExcelCompiler.from_file(filename).cell_map['Sheet1!D1']
+        assert formula.filename == filename
+        assert formula.lineno == expected.formula.lineno > 1
+
+
+def test_pickle_without_text_round_trip(excel_compiler):
+    input_addrs = ['trim-range!D5']
+    output_addrs = ['trim-range!B2']
+    excel_compiler.trim_graph(input_addrs, output_addrs)
+
+    excel_compiler.to_file(file_types=('yml', ))
+    expected = ExcelCompiler.from_file(excel_compiler.filename + '.yml')
+
+    with mock.patch.object(ExcelCompiler, '_to_text') as to_text:
+        excel_compiler.to_file(file_types=('pkl', ))
+    assert not to_text.called
+    loaded = ExcelCompiler.from_file(excel_compiler.filename + '.pkl')
+
+    def edges(compiler):
+        return {(str(a.address), str(b.address))
+                for a, b in compiler.dep_graph.edges()}
+
+    assert set(loaded.cell_map) == set(expected.cell_map)
+    assert edges(loaded) == edges(expected)
+    assert loaded.extra_data == expected.extra_data == {}
+    assert loaded.evaluate(output_addrs) == expected.evaluate(output_addrs)
+
+    loaded.set_value(input_addrs[0], 100)
+    expected.set_value(input_addrs[0], 100)
+    assert loaded.evaluate(output_addrs) == expected.evaluate(output_addrs)
+
+    excel_compiler.extra_data = {'a': 3}
+    excel_compiler.to_file(file_types=('pkl', ))
+    loaded = ExcelCompiler.from_file(excel_compiler.filename + '.pkl')
+    assert loaded.extra_data == {'a': 3}
+
+
+@pytest.mark.parametrize('file_type', ('yml', 'json'))
+def test_from_file_without_line_numbers(excel_compiler, file_type):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.extra_data = {'a': 3}
+    excel_compiler.to_file(file_types=(file_type, ))
+    filename = excel_compiler.filename + '.' + file_type
+
+    with mock.patch('pycel.excelcompiler.YAML') as yaml:
+        yaml.side_effect = YAML
+        loaded = ExcelCompiler.from_file(filename, line_numbers=False)
+    assert [c[1] for c in yaml.call_args_list] == (
+        [] if file_type == 'json' else [dict(typ='safe')])
+
+    assert loaded.extra_data == {'a': 3}
+    assert loaded.cell_map['Sheet1!D1'].formula.lineno == 1
+    assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+    loaded.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+
+@pytest.mark.parametrize('file_type', ('yml', 'json'))
+@pytest.mark.parametrize('line_numbers', (True, False))
+def test_to_file_templates(excel_compiler, file_type, line_numbers):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.extra_data = {'a': 3}
+    filename = excel_compiler.filename + '.' + file_type
+    excel_compiler.to_file(file_types=(file_type, ))
+    size = os.path.getsize(filename)
+    excel_compiler.to_file(file_types=(file_type, ), templates=True)
+    assert os.path.getsize(filename) < size
+    assert 'formula_templates' not in excel_compiler.extra_data
+
+    with open(filename) as f:
+        text = f.read()
+    assert text.count('=#0') == 18
+    assert text.count('=#1') == 18
+
+    loaded = ExcelCompiler.from_file(filename, line_numbers=line_numbers)
+    assert loaded.extra_data == {'a': 3}
+    assert loaded.cell_map['Sheet1!C2'].formula.python_code == (
+        'sin(_C_("Sheet1!B2") * (_C_("Sheet1!A2") ** 2))')
+    if line_numbers:
+        # the formulas are shown at the line of their template
+        lineno = loaded.cell_map['Sheet1!C2'].formula.lineno
+        assert lineno == loaded.cell_map['Sheet1!C9'].formula.lineno
+        assert 'Sheet1!R[0]C[-1]' in text.splitlines()[lineno - 1]
+    assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+    loaded.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+    loaded = ExcelCompiler.from_file(filename, lazy=True)
+    assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+    # the templates are versioned
+    assert 'template_format_version' in text
+    assert 'template_format_version' not in excel_compiler.extra_data
+    with open(filename, 'w') as f:
+        f.write(text.replace('template_format_version": 1',
+                             'template_format_version": 2')
+                .replace('template_format_version: 1',
+                         'template_format_version: 2'))
+    with pytest.raises(ValueError, match='Unsupported template format 2'):
+        ExcelCompiler.from_file(filename, line_numbers=line_numbers)
+
+
+@pytest.mark.parametrize('file_type', ('yml', 'json'))
+@pytest.mark.parametrize('lazy', (True, False))
+def test_to_file_snapshot(excel_compiler, file_type, lazy, caplog):
+    excel_compiler.evaluate('Sheet1!D1')
+
+    # numpy values are stored as python numbers
+    address = AddressCell('Sheet1!F1')
+    cell = _Cell(address, None, '=SUMPRODUCT(Sheet1!A1:A3, Sheet1!B1:B3)',
+                 excel_compiler.excel)
+    excel_compiler.cell_map[str(address)] = cell
+    excel_compiler.dep_graph.add_node(cell)
+    excel_compiler.graph_todos.append(cell)
+    excel_compiler._process_gen_graph()
+    assert isinstance(excel_compiler.evaluate(address), np.int64)
+
+    excel_compiler.to_file(file_types=(file_type, ), snapshot=True)
+    filename = excel_compiler.filename + '.' + file_type
+
+    # a loaded model has the evaluated values without evaluating them
+    with mock.patch.object(ExcelCompiler, 'eval') as evaluate:
+        loaded = ExcelCompiler.from_file(filename, lazy=lazy)
+        assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+        assert loaded.evaluate(address) == 60
+    assert not evaluate.called
+    if not lazy:
+        assert loaded.cell_map['Sheet1!B1:B18'].value == tuple(
+            (v, ) for v in excel_compiler.evaluate('Sheet1!B1:B18'))
+    loaded.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+    assert 'snapshot' not in loaded.extra_data
+
+    # the snapshot is not used if the cells have changed
+    with open(filename) as f:
+        text = f.read()
+    with open(filename, 'w') as f:
+        f.write(text.replace('"Sheet1!A1": 1,', '"Sheet1!A1": 200,')
+                .replace('Sheet1!A1: 1\n', 'Sheet1!A1: 200\n'))
+    loaded = ExcelCompiler.from_file(filename, lazy=lazy)
+    assert 'Snapshot does not match the model' in caplog.text
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+
+def test_snapshot_unstorable_values(excel_compiler):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.cell_map['Sheet1!D1'].value = datetime.date(2020, 1, 2)
+    excel_compiler.cell_map['Sheet1!B1:B18'].value = (
+        (datetime.date(2020, 1, 2), ), )
+    values = excel_compiler._evaluated_values()
+    assert 'Sheet1!D1' not in values
+    assert 'Sheet1!B1:B18' not in values
+    assert 'Sheet1!C1:C18' in values
+
+
+def test_to_file_snapshot_pickle(excel_compiler):
+    excel_compiler.evaluate('Sheet1!D1')
+    excel_compiler.to_file(file_types=('pkl', 'yml'), snapshot=True)
+    with open(excel_compiler.filename + '.yml') as f:
+        assert 'fingerprint' in f.read()
+
+    with mock.patch.object(ExcelCompiler, 'eval') as evaluate:
+        loaded = ExcelCompiler.from_file(excel_compiler.filename + '.pkl')
+        assert -0.02286 == round(loaded.evaluate('Sheet1!D1'), 5)
+    assert not evaluate.called
+
+    # only the values of evaluated cells and ranges are stored
+    excel_compiler.set_value('Sheet1!A1', 200)
+    expected = excel_compiler.evaluate('Sheet1!A:A')
+    excel_compiler.to_file(file_types=('pkl', 'yml'), snapshot=True)
+    loaded = ExcelCompiler.from_file(excel_compiler.filename + '.pkl')
+    assert loaded.cell_map['Sheet1!D1'].value is None
+    assert loaded.evaluate('Sheet1!A:A') == expected
+    assert -0.00331 == round(loaded.evaluate('Sheet1!D1'), 5)
+
+
+def test_formula_templates():
+    code = '=_C_("Sheet1!A2") + xsum(_R_("Sheet1!{}"))'
+    cell_values = (
+        ('Sheet1!B1', 1),
+        ('Sheet1!B2', code.format('A:A')),
+        ('Sheet1!C2', '=_C_("Sheet1!B2") + xsum(_R_("Sheet1!B:B"))'),
+        ('Sheet1!B3', '=_C_("Sheet1!A3") + xsum(_R_("Sheet1!3:4"))'),
+        ('Sheet1!B4', '=_C_("Sheet1!A4") + xsum(_R_("Sheet1!4:5"))'),
+        ('Sheet1!B5', code.format('A1:B2')),
+        ('Sheet1!B6', '=_C_("sheet1!a2")'),
+        ('Sheet1!B7', '=_C_("sheet1!a2")'),
+        ('Sheet1!A:A', '=_REF_("Sheet1!B:B")'),
+        ('Sheet1!B:B', '=_REF_("Sheet1!B:B")'),
+    )
+    templated, templates = _formula_templates(cell_values)
+    assert templates == [
+        '_C_("Sheet1!R[0]C[-1]") + xsum(_R_("Sheet1!C[-1]:C[-1]"))',
+        '_C_("Sheet1!R[0]C[-1]") + xsum(_R_("Sheet1!R[0]:R[1]"))',
+    ]
+    assert templated == [
+        ('Sheet1!B1', 1),
+        ('Sheet1!B2', '=#0'),
+        ('Sheet1!C2', '=#0'),
+        ('Sheet1!B3', '=#1'),
+        ('Sheet1!B4', '=#1'),
+    ] + list(cell_values[5:])
+
+
 def test_filename_ext(excel_compiler, fixture_xls_path):
     excel_compiler.evaluate('Sheet1!D1')
     excel_compiler.extra_data = {1: 3}
@@ -171,6 +571,336 @@ def test_recalculate(excel_compiler):
     assert -0.02286 == round(excel_compiler.cell_map[out_address].value, 5)
 
 
+def test_snapshot_values(excel_compiler):
+    in_address = 'Sheet1!A1'
+    out_address = 'Sheet1!D1'
+    assert -0.02286 == round(excel_compiler.evaluate(out_address), 5)
+    out_cell = excel_compiler.cell_map[out_address]
+    out_value = out_cell.value
+
+    snapshot = excel_compiler.snapshot_values()
+    assert snapshot == {}
+
+    for _ in range(2):
+        excel_compiler.set_value(in_address, 200)
+        assert -0.00331 == round(excel_compiler.evaluate(out_address), 5)
+
+        # only the changed cells are saved, and restored
+        changed = {cell.address.address for cell in snapshot}
+        assert {in_address, out_address, 'Sheet1!B1:B18'} <= changed
+        assert 'Sheet1!A2' not in changed
+        assert snapshot[out_cell] == out_value
+
+        excel_compiler.restore_values(snapshot)
+        assert snapshot == {}
+        assert excel_compiler.cell_map[in_address].value == 1
+        assert out_cell.value == out_value
+        assert excel_compiler.cell_map['Sheet1!B1:B18'].value[0][0] == 6
+
+    excel_compiler.recalculate()
+    assert out_cell in snapshot
+    excel_compiler.restore_values(snapshot)
+    assert out_cell.value == out_value
+
+    new_snapshot = excel_compiler.snapshot_values()
+    with pytest.raises(ValueError, match='Can only restore the last'):
+        excel_compiler.restore_values(snapshot)
+
+    # the snapshot is not pickled
+    assert pickle.loads(pickle.dumps(excel_compiler))._saved_values is None
+    excel_compiler.restore_values(new_snapshot)
+
+
+def test_recalculate_calc_chain(fixture_xls_path):
+    excel = ExcelXlsxWrapper(fixture_xls_path)
+    excel.connect()
+    excel_compiler = ExcelCompiler(excel=excel, use_calc_chain=True)
+    out_address = 'Sheet1!D1'
+    assert -0.02286 == round(excel_compiler.evaluate(out_address), 5)
+
+    chain = excel_compiler.calc_chain
+    assert out_address in {cell.address.address for cell in chain}
+    assert chain is excel_compiler.calc_chain
+
+    # formula precedents come earlier in the chain
+    for i, cell in enumerate(chain):
+        for precedent in excel_compiler.dep_graph.predecessors(cell):
+            if isinstance(precedent, _Cell) and precedent.formula:
+                assert precedent in chain[:i]
+
+    excel_compiler.cell_map['Sheet1!A1'].value = 200
+    excel_compiler.recalculate()
+    assert -0.00331 == round(excel_compiler.cell_map[out_address].value, 5)
+
+    # the precedents of each range are only walked once
+    shared_range = excel_compiler.cell_map['Sheet1!A1:A3']
+    excel_compiler.dep_graph.add_edge(
+        shared_range, excel_compiler.cell_map['Sheet1!B2'])
+    excel_compiler._calc_chain = None
+    with mock.patch.object(excel_compiler.dep_graph, 'predecessors',
+                           side_effect=excel_compiler.dep_graph.predecessors
+                           ) as predecessors:
+        assert excel_compiler.calc_chain == chain
+    ranges = [args[0] for args, kwargs in predecessors.call_args_list
+              if isinstance(args[0], _CellRange)]
+    assert ranges
+    assert len(ranges) == len(set(ranges))
+
+    # an order which does not match the graph is not used
+    excel_compiler._calc_chain = None
+    with mock.patch.object(excel, 'get_calc_chain',
+                           return_value=tuple(reversed(excel.calc_chain))):
+        assert excel_compiler.calc_chain == ()
+
+    excel_compiler.use_calc_chain = False
+    assert excel_compiler.calc_chain == ()
+
+
+def test_recalculate_calc_chain_opx_wrapper(fixture_xls_path):
+    excel_compiler = ExcelCompiler(fixture_xls_path, use_calc_chain=True)
+    out_address = 'Sheet1!D1'
+    assert -0.02286 == round(excel_compiler.evaluate(out_address), 5)
+    assert out_address in {
+        cell.address.address for cell in excel_compiler.calc_chain}
+
+    excel_compiler.cell_map['Sheet1!A1'].value = 200
+    excel_compiler.recalculate()
+    assert -0.00331 == round(excel_compiler.cell_map[out_address].value, 5)
+
+
+def test_finalize(fixture_xls_path):
+    excel = ExcelXlsxWrapper(fixture_xls_path)
+    excel.connect()
+    excel_compiler = ExcelCompiler(excel=excel, use_calc_chain=True)
+    excel = weakref.ref(excel)
+
+    # cells not yet linked are built before the workbook is released
+    excel_compiler._make_cells(AddressCell('Sheet1!D1'))
+    excel_compiler.finalize()
+    gc.collect()
+    assert excel() is None
+    assert all(cell.excel is None for cell in excel_compiler.cell_map.values())
+
+    formula = excel_compiler.cell_map['Sheet1!D1'].formula
+    assert 'degree=1' in formula.python_code
+    assert excel_compiler.calc_chain
+    assert -0.02286 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+    excel_compiler.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+    excel_compiler.recalculate()
+    assert -0.00331 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+
+
+def test_compiler_from_memory(fixture_xls_path):
+    with open(fixture_xls_path, 'rb') as f:
+        contents = f.read()
+
+    excel_compiler = ExcelCompiler(filename=contents)
+    assert excel_compiler.filename is None
+    assert (excel_compiler._excel_file_md5_digest ==
+            ExcelCompiler._compute_file_md5_digest(fixture_xls_path))
+    assert excel_compiler.hash_matches
+    assert -0.02286 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+
+    # there is no workbook filename to save next to
+    with pytest.raises(ValueError, match='A filename is needed'):
+        excel_compiler.to_file()
+    with pytest.raises(ValueError, match='A filename is needed'):
+        excel_compiler._to_text()
+    with pytest.raises(ValueError, match='A filename is needed'):
+        excel_compiler.export_to_gexf()
+
+    excel_compiler.excel = None
+    assert not excel_compiler.hash_matches
+
+
+def test_compiled_cache(fixture_xls_path, tmpdir):
+    cache_dir = str(tmpdir.join('compiled_cache'))
+    excel_compiler = ExcelCompiler(fixture_xls_path, cache=cache_dir)
+    assert os.listdir(cache_dir) == []
+    assert -0.02286 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+    assert len(os.listdir(cache_dir)) == 1
+
+    # the entry is written as the cells are built, without save_to_cache
+    with mock.patch.object(ExcelOpxWrapper, 'connect') as connect:
+        cached = ExcelCompiler(fixture_xls_path, cache=cache_dir)
+        assert -0.02286 == round(cached.evaluate('Sheet1!D1'), 5)
+    assert not connect.called
+    assert isinstance(cached.cache, CompiledCache)
+    assert 'Sheet1!D1' in cached.cell_map
+    assert cached.hash_matches
+
+    # only the model is cached, the workbook is read if cells are needed
+    with open(cached.cache._path(cached._cache_key), 'rb') as f:
+        assert pickle.load(f).excel is None
+    assert cached.excel.workbook is None
+    assert 'Sheet2!A1' not in cached.cell_map
+    assert cached.evaluate('Sheet2!A1') == excel_compiler.evaluate('Sheet2!A1')
+    assert cached.excel.workbook is not None
+
+    with mock.patch.object(ExcelOpxWrapper, 'connect', autospec=True,
+                           side_effect=ExcelOpxWrapper.connect) as connect:
+        cached = ExcelCompiler(fixture_xls_path, cache=cache_dir)
+        cached.formula_cells('Sheet1')
+        cached.formula_cells('Sheet1')
+    assert connect.call_count == 1
+
+    # the entry is only rewritten when the model has doubled in size
+    with mock.patch.object(CompiledCache, 'put') as put:
+        cached.evaluate('Sheet1!A1')
+        assert not put.called
+        cached.evaluate('Sheet1!A1:B200')
+        assert put.called
+
+    # different options are a different entry
+    ExcelCompiler(fixture_xls_path, cache=cache_dir,
+                  lazy_ranges=True).evaluate('Sheet1!D1')
+    assert len(os.listdir(cache_dir)) == 2
+
+    with pytest.raises(ValueError, match='not loaded with a cache'):
+        ExcelCompiler(fixture_xls_path).save_to_cache()
+
+
+def test_compiled_cache_tables(fixture_xls_path, tmpdir):
+    cache_dir = str(tmpdir.join('compiled_cache_tables'))
+    excel_compiler = ExcelCompiler(fixture_xls_path, cache=cache_dir)
+    expected = excel_compiler.evaluate('sref!A4')
+    assert excel_compiler.excel._tables
+    excel_compiler.save_to_cache()
+
+    cached = ExcelCompiler(fixture_xls_path, cache=cache_dir)
+    assert cached.evaluate('sref!A4') == expected
+
+    # a failed write does not leave a partial entry
+    with mock.patch('pycel.excelcompiler.pickle.dump') as dump:
+        dump.side_effect = pickle.PicklingError
+        with pytest.raises(pickle.PicklingError):
+            excel_compiler.save_to_cache()
+    assert not any(name.endswith('.tmp') for name in os.listdir(cache_dir))
+
+
+def test_formula_cache(fixture_xls_path, tmpdir):
+    filename = str(tmpdir.join('compiler_formula_cache.sqlite'))
+    excel_compiler = ExcelCompiler(fixture_xls_path, formula_cache=filename)
+    assert isinstance(excel_compiler.formula_cache, FormulaCache)
+    excel_compiler.evaluate('Sheet1!D1')
+    expected = excel_compiler.evaluate('Sheet1!C1:C18')
+
+    # the translations are shared with the next workbook, (D1 is a LINEST
+    # which needs the workbook, so is not cached)
+    with mock.patch.object(ExcelFormula, '_parse_to_rpn') as parse:
+        cached = ExcelCompiler(fixture_xls_path, formula_cache=filename)
+        assert cached.evaluate('Sheet1!C1:C18') == expected
+    assert not parse.called
+    assert pickle.loads(pickle.dumps(cached)).formula_cache is None
+
+    # a compiler loaded from a CompiledCache uses the formula cache too
+    cache_dir = str(tmpdir.join('formula_compiled_cache'))
+    ExcelCompiler(fixture_xls_path, cache=cache_dir).evaluate('Sheet1!B1')
+    cached = ExcelCompiler(fixture_xls_path, cache=cache_dir,
+                           formula_cache=excel_compiler.formula_cache)
+    assert cached.formula_cache is excel_compiler.formula_cache
+
+
+def test_compiled_cache_eviction(fixture_xls_path, tmpdir, caplog):
+    cache = CompiledCache(str(tmpdir.join('eviction_cache')))
+    excel_compiler = ExcelCompiler(fixture_xls_path)
+    for i, key in enumerate('abc'):
+        cache.put(key, excel_compiler)
+        os.utime(cache._path(key), (i, i))
+    assert cache.get('a') is not None
+    entry_size = os.path.getsize(cache._path('a'))
+
+    # 'b' is the least recently used
+    cache.max_size = entry_size * 7 // 2
+    cache.put('d', excel_compiler)
+    assert sorted(os.listdir(cache.cache_dir)) == [
+        'a.pkl', 'c.pkl', 'd.pkl']
+    assert cache.get('b') is None
+
+    with open(cache._path('c'), 'wb') as f:
+        f.write(b'junk')
+    assert cache.get('c') is None
+    assert 'Removing unreadable cache entry' in caplog.text
+    assert not os.path.exists(cache._path('c'))
+
+
+def test_compiled_cache_shared(fixture_xls_path, tmpdir):
+    # other processes sharing the cache can remove entries at any time
+    cache = CompiledCache(str(tmpdir.join('shared_cache')))
+    excel_compiler = ExcelCompiler(fixture_xls_path)
+    cache.put('a', excel_compiler)
+    cache.put('b', excel_compiler)
+
+    with mock.patch('pycel.excelcompiler.os.utime') as utime:
+        utime.side_effect = FileNotFoundError
+        assert cache.get('a') is None
+
+    with open(cache._path('b'), 'wb') as f:
+        f.write(b'junk')
+    with mock.patch('pycel.excelcompiler.os.unlink') as unlink:
+        unlink.side_effect = FileNotFoundError
+        assert cache.get('b') is None
+
+        cache.max_size = 0
+        cache.evict()
+        assert unlink.call_count == 3
+
+    stat = os.stat
+
+    def vanished_a(path):
+        if path.endswith('a.pkl'):
+            raise FileNotFoundError(path)
+        return stat(path)
+
+    with mock.patch('pycel.excelcompiler.os.stat', side_effect=vanished_a):
+        cache.evict()
+    assert sorted(os.listdir(cache.cache_dir)) == ['a.pkl']
+
+
+@pytest.fixture('module')
+def changed_xlsx(fixture_xls_path):
+    workbook = openpyxl.load_workbook(fixture_xls_path)
+    ws = workbook['Sheet1']
+    ws['A1'] = 200
+    ws['B18'] = '=SUM(A18:A21)+A30'
+    ws['A30'] = 1000
+    ws['C3'] = 5
+    data = io.BytesIO()
+    workbook.save(data)
+    return data.getvalue()
+
+
+@pytest.mark.parametrize('file_type', (None, 'yml'))
+def test_update_from(excel_compiler, changed_xlsx, file_type):
+    output = 'Sheet1!D1'
+    excel_compiler.evaluate(output)
+    if file_type:
+        excel_compiler.to_file(file_types=(file_type, ))
+        excel_compiler = ExcelCompiler.from_file(
+            excel_compiler.filename + '.' + file_type)
+        excel_compiler.evaluate(output)
+    expected = ExcelCompiler(changed_xlsx).evaluate(output)
+
+    changed = excel_compiler.update_from(changed_xlsx)
+    assert set(changed) == {'Sheet1!A1', 'Sheet1!B18', 'Sheet1!C3'}
+
+    # cells outside the changed cones keep their values
+    assert excel_compiler.cell_map['Sheet1!B10'].value == 33
+    assert excel_compiler.cell_map['Sheet1!B1'].value is None
+    assert excel_compiler.cell_map['Sheet1!C3'].formula is None
+
+    # new precedents are linked
+    assert excel_compiler.cell_map['Sheet1!A30'].value == 1000
+    assert excel_compiler.evaluate(output) == pytest.approx(expected)
+    assert excel_compiler.evaluate(output) != pytest.approx(-0.02286)
+
+    # unchanged update is a no-op
+    value = excel_compiler.cell_map[output].value
+    assert excel_compiler.update_from(changed_xlsx) == ()
+    assert excel_compiler.cell_map[output].value == value
+
+
 def test_evaluate_from_generator(excel_compiler):
     result = excel_compiler.evaluate(
         a for a in ('trim-range!B1', 'trim-range!B2'))
@@ -304,6 +1034,65 @@ def test_validate_calcs(excel_compiler, capsys):
     assert 'JUNK' in out
 
 
+def test_validate_calcs_xlsx_wrapper(fixture_xls_path):
+    excel = ExcelXlsxWrapper(fixture_xls_path)
+    excel.connect()
+    excel_compiler = ExcelCompiler(excel=excel)
+    assert {} == excel_compiler.validate_calcs()
+
+    excel_compiler.set_value('Sheet1!A1', 200)
+    assert -0.00331 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+
+
+def test_evaluate_lazy_sheets(fixture_xls_path):
+    excel_compiler = ExcelCompiler(fixture_xls_path, lazy_sheets=True)
+    excel = excel_compiler.excel
+    assert isinstance(excel, ExcelXlsxWrapper)
+    assert -0.02286 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+    assert [ws.title for ws in excel.workbook if ws.is_loaded] == ['Sheet1']
+
+
+def test_evaluate_parse_workers(fixture_xls_path):
+    excel_compiler = ExcelCompiler(fixture_xls_path, parse_workers=2)
+    excel = excel_compiler.excel
+    assert isinstance(excel, ExcelXlsxWrapper)
+    assert excel.parse_workers == 2
+    assert -0.02286 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+
+
+def test_shared_formulas_xlsx_wrapper(fixture_xls_path):
+    excel = ExcelXlsxWrapper(fixture_xls_path)
+    excel.connect()
+    excel_compiler = ExcelCompiler(excel=excel)
+    assert {} == excel_compiler.validate_calcs()
+
+    shared = [cell for cell in excel_compiler.cell_map.values()
+              if isinstance(cell, _Cell) and cell.formula and
+              excel.get_shared_formula(cell.address)]
+    assert len(shared) > len(excel_compiler._shared_formulas) > 0
+    for cell in shared:
+        # same python as parsing the (translated) formula of the cell
+        expected = ExcelFormula(cell.formula.base_formula, cell=cell)
+        assert expected.python_code == cell.formula.python_code
+
+
+def test_shared_formulas_duck_typed_wrapper(fixture_xls_path):
+    class DuckTypedWrapper:
+        def __init__(self, excel):
+            self.excel = excel
+
+        def __getattr__(self, name):
+            if name == 'get_shared_formula':
+                raise AttributeError(name)
+            return getattr(self.excel, name)
+
+    excel = ExcelXlsxWrapper(fixture_xls_path)
+    excel.connect()
+    excel_compiler = ExcelCompiler(excel=DuckTypedWrapper(excel))
+    assert -0.02286 == round(excel_compiler.evaluate('Sheet1!D1'), 5)
+    assert excel_compiler._shared_formulas == {}
+
+
 def test_validate_calcs_all_cells(basic_ws):
     formula_cells = basic_ws.formula_cells('Sheet1')
     expected = {
@@ -578,6 +1367,46 @@ def test_evaluate_empty_intersection(fixture_dir):
     assert excel_compiler.evaluate(address) == NULL_ERROR
 
 
+def test_evaluate_lazy_ranges(excel_compiler):
+    excel_compiler.lazy_ranges = True
+    excel_compiler._eval = None
+
+    address = AddressCell('Sheet1!F1')
+    cell = _Cell(
+        address, None, '=INDEX(Sheet1!B1:B18, 3)', excel_compiler.excel)
+    excel_compiler.cell_map[str(address)] = cell
+    excel_compiler.dep_graph.add_node(cell)
+    excel_compiler.graph_todos.append(cell)
+    excel_compiler._process_gen_graph()
+    for row in range(1, 19):
+        excel_compiler.cell_map['Sheet1!B{}'.format(row)].value = None
+
+    assert excel_compiler.evaluate(address) == 12
+    assert excel_compiler.cell_map['Sheet1!B1:B18'].value is None
+    evaluated = [row for row in range(1, 19) if excel_compiler.cell_map[
+        'Sheet1!B{}'.format(row)].value is not None]
+    assert evaluated == [3]
+
+    # changing an input cell resets the lazy range and its dependents
+    excel_compiler.set_value('Sheet1!A3', 10)
+    assert excel_compiler.cell_map['Sheet1!B1:B18'].lazy_range is None
+    assert excel_compiler.evaluate(address) == 19
+    assert excel_compiler._evaluate_lazy_range('None') == NULL_ERROR
+
+
+def test_range_lookup_index_invalidated(excel_compiler):
+    address = 'Sheet1!A1:A18'
+    excel_compiler.evaluate(address)
+    values = excel_compiler._evaluate_range(address)
+    assert isinstance(values, RangeValues)
+    assert values.column(0).index[(0, 3)] == 3
+
+    excel_compiler.set_value('Sheet1!A3', 100)
+    values = excel_compiler._evaluate_range(address)
+    assert (0, 3) not in values.column(0).index
+    assert values.column(0).index[(0, 100)] == 3
+
+
 def test_plugins(excel_compiler):
 
     input_addrs = ['Sheet1!A11']
@@ -8,12 +8,14 @@ import pytest
 from pycel.excelformula import (
     ASTNode,
     ExcelFormula,
+    FormulaCache,
     FormulaEvalError,
     FormulaParserError,
     Token,
     UnknownFunction,
 )
 from pycel.excelutil import AddressCell, DIV0, NAME_ERROR, VALUE_ERROR
+from pycel.lib.function_helpers import is_lazy_param
 from test_excelutil import ATestCell
 
 
@@ -539,6 +541,23 @@ def test_needed_addresses():
     assert excel_formula.needed_addresses == (AddressCell('S!A1'), )
 
 
+@pytest.mark.parametrize(
+    'master, offset, formula', (
+        ('=A1+B1', (0, 0), '=A1+B1'),
+        ('=A1+B1', (2, 1), '=B3+C3'),
+        ('=SUM($A1:B$2)*Sheet2!C3', (3, 2), '=SUM($A4:D$2)*Sheet2!E6'),
+        ('=IF(A1>0,MAX(A:A),"A1")', (1, 1), '=IF(B2>0,MAX(B:B),"A1")'),
+        ('={1,2;3,4}', (1, 0), '={1,2;3,4}'),
+    )
+)
+def test_share_rpn(master, offset, formula):
+    cell = ATestCell('A', 1, sheet='s')
+    expected = ExcelFormula(formula, cell=cell)
+    excel_formula = ExcelFormula(formula, cell=cell)
+    excel_formula.share_rpn(ExcelFormula(master), *offset)
+    assert expected.python_code == excel_formula.python_code
+
+
 @pytest.mark.parametrize(
     'result, formula', (
         (42, '=2 * 21'),
@@ -552,6 +571,27 @@ def test_build_eval_context(result, formula):
     assert eval_context(ExcelFormula(formula)) == pytest.approx(result)
 
 
+def test_build_eval_context_lazy_ranges():
+    formula = '=INDEX(A1:A2, 2) + SUM(A1:A2)'
+    eval_context = ExcelFormula.build_eval_context(
+        None, lambda x: ((1, ), (2, )))
+    with mock.patch('pycel.excelformula.is_lazy_param') as lazy_check:
+        assert eval_context(ExcelFormula(formula)) == 5
+    assert lazy_check.call_count == 0
+
+    eval_context = ExcelFormula.build_eval_context(
+        None, lambda x: ((1, ), (2, )),
+        evaluate_lazy_range=lambda x: ((3, ), (4, )))
+    with mock.patch('pycel.excelformula.is_lazy_param',
+                    side_effect=is_lazy_param) as lazy_check:
+        excel_formula = ExcelFormula(formula)
+        assert eval_context(excel_formula) == 7
+        assert eval_context(excel_formula) == 7
+
+    # laziness is only checked once for each function param
+    assert lazy_check.call_count == 2
+
+
 def test_math_wrap():
     eval_context = ExcelFormula.build_eval_context(
         lambda x: None, lambda x: DIV0)
@@ -839,6 +879,82 @@ def test_plugins():
         assert eval_ctx(ExcelFormula('=sum({1,2,3})')) == 6
 
 
+@pytest.mark.parametrize(
+    'formula, context_free', (
+        ('=A1+Sheet2!$B$2:C3', True),
+        ('=SUM(A:A)+SUM(1:1)', True),
+        ('=1+2', True),
+        ('=ROW()', False),
+        ('=LINEST(A1:A3,B1:B3)', False),
+        ('=a_name+1', False),
+        ('=Foo+1', False),
+        ('=Table1[Col]', False),
+    )
+)
+def test_is_context_free(formula, context_free):
+    assert ExcelFormula(formula)._is_context_free == context_free
+
+
+def test_marshalled_python():
+    formula = ExcelFormula('=1 + A1')
+    code, names = formula.marshalled_python
+    assert names == {'_C_', 'lambdas'}
+
+    loaded = ExcelFormula('=1 + _C_("A1")', formula_is_python_code=True)
+    loaded.marshalled_python = code, names
+    with mock.patch.object(ExcelFormula, '_compile_python_ast') as comp:
+        assert loaded.compiled_python[1] == names
+    assert not comp.called
+
+    assert ExcelFormula('=1 +', formula_is_python_code=True
+                        ).marshalled_python is None
+
+
+def test_formula_cache(tmpdir):
+    filename = str(tmpdir.join('formula_cache.sqlite'))
+    cache = FormulaCache(filename)
+    cell = ATestCell('A', 1, sheet='s')
+
+    formula = ExcelFormula('=B1*2', cell=cell)
+    formula.formula_cache = cache
+    assert formula.python_code == '_C_("s!B1") * 2'
+    key = cache.key('=B1*2', 's')
+    assert cache.get(key) == ('_C_("s!B1") * 2', None)
+
+    # compiled code is added once compiled
+    assert formula.compiled_python
+    assert cache.get(key)[1][0] == formula._marshalled_python[0]
+    cache.close()
+
+    # a new cache on the same file translates without parsing
+    cache = FormulaCache(filename)
+    cached = ExcelFormula('=B1*2', cell=ATestCell('C', 3, sheet='s'))
+    cached.formula_cache = cache
+    with mock.patch.object(ExcelFormula, '_parse_to_rpn') as parse:
+        assert cached.python_code == formula.python_code
+        assert cached.compiled_python[1] == formula.compiled_python[1]
+    assert not parse.called
+
+    # different sheet is a different entry, context formulas are not cached
+    other = ExcelFormula('=B1*2', cell=ATestCell('A', 1, sheet='t'))
+    other.formula_cache = cache
+    assert other.python_code == '_C_("t!B1") * 2'
+    row = ExcelFormula('=ROW()', cell=cell)
+    row.formula_cache = cache
+    assert row.python_code == 'row(_REF_("s!A1"))'
+    assert cache.get(cache.key('=ROW()', 's')) is None
+    cache.commit()
+
+    count = cache.connection.execute('SELECT COUNT(*) FROM formulas')
+    assert count.fetchone()[0] == 2
+
+    # writes are committed in batches
+    cache.COMMIT_EVERY = 1
+    cache.put(cache.key('=1', 's'), '1')
+    assert cache._pending == 0
+    assert pickle.loads(pickle.dumps(cached)).formula_cache is None
+
+
 def test_unknown_name(empty_eval_context):
     assert NAME_ERROR == empty_eval_context(ExcelFormula('=CE'))
 
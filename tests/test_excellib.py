@@ -58,10 +58,13 @@ from pycel.excelutil import (
     AddressRange,
     DIV0,
     ExcelCmp,
+    LazyRange,
+    LookupVector,
     NA_ERROR,
     NAME_ERROR,
     NUM_ERROR,
     PyCelException,
+    RangeValues,
     REF_ERROR,
     VALUE_ERROR,
 )
@@ -93,6 +96,60 @@ def test_average():
     assert DIV0 == average((2, DIV0))
 
 
+def test_lazy_range_lookups():
+    data = ((1, 'a'), (2, 'b'), (3, 'c'), (4, 'd'))
+    accessed = set()
+
+    def get_value(row, col):
+        accessed.add((row, col))
+        return data[row][col]
+
+    lazy = LazyRange(AddressRange('A1:B4').size, get_value)
+
+    assert index(lazy, 3, 2) == 'c'
+    assert accessed == {(2, 1)}
+
+    accessed.clear()
+    lazy_col = LazyRange(AddressRange('A1:A4').size, get_value)
+    assert match(2, lazy_col, 0) == 2
+    assert accessed == {(0, 0), (1, 0)}
+
+    accessed.clear()
+    assert vlookup(3, lazy, 2, False) == 'c'
+    assert (0, 1) not in accessed
+    assert (2, 1) in accessed
+
+    accessed.clear()
+    assert lookup(4, lazy) == 'd'
+    assert {col for row, col in accessed if row != 3} == {0}
+
+
+@pytest.mark.parametrize(
+    'lookup_value, result, match_idx', (
+        (3, 'c', 3),
+        (1.0, 'a', 1),
+        ('b', 'b', 2),
+        ('B*', 'b', 2),
+        (True, 't', 5),
+        ('z', NA_ERROR, NA_ERROR),
+        (4, NA_ERROR, NA_ERROR),
+    )
+)
+def test_exact_lookups_with_lookup_index(lookup_value, result, match_idx):
+    table = RangeValues(
+        ((1, 'a'), ('B', 'b'), (3, 'c'), ('b', 'x'), (True, 't')))
+    transposed = RangeValues(zip(*table))
+
+    assert vlookup(lookup_value, table, 2, False) == result
+    assert hlookup(lookup_value, transposed, 2, False) == result
+    assert match(lookup_value, table, 0) == match_idx
+    assert match(lookup_value, RangeValues(transposed[:1]), 0) == match_idx
+
+    # exact matches without wildcards are found via the cached index
+    is_wildcard = isinstance(lookup_value, str) and '*' in lookup_value
+    assert ('_index' in table.column(0).__dict__) != is_wildcard
+
+
 @pytest.mark.parametrize(
     'value, expected', (
         (1, 1),
@@ -213,6 +270,14 @@ class TestCountIf:
     def test_countif_regular(self):
         assert 2 == countif(((7, 25, 13, 25), ), 25)
 
+    def test_countif_wildcard(self):
+        assert 2 == countif((('abc', 25, None, 'Axe'), ), 'a*')
+
+    def test_countif_mixed_types(self):
+        assert 5 == countif(((7, '7', True, None, 'b', 8), ), '<>7')
+        assert 2 == countif(((7, '7', True, None, 'b', 8), ), 7)
+        assert 2 == countif(((7, '7', True, None, 'b', 8), ), '<8')
+
 
 class TestCountIfs:
     # more tests might be welcomed
@@ -225,6 +290,10 @@ class TestCountIfs:
         with pytest.raises(PyCelException):
             countifs(((7, 25, 13, 25), ), 25, ((100, 102, 201, 20), ))
 
+    def test_countifs_size_mismatch(self):
+        assert VALUE_ERROR == countifs(((7, 25, 13, 25), ), 25,
+                                       ((100, 102, 201), ), ">100")
+
 
 class TestDate:
 
@@ -661,6 +730,12 @@ def test_match(lookup_value, lookup_array, match_type, result):
     assert result == match(lookup_value, lookup_row, match_type)
     assert result == match(lookup_value, lookup_col, match_type)
 
+    # again with the cached lookup vectors
+    lookup_row = RangeValues(lookup_row)
+    lookup_col = RangeValues(lookup_col)
+    assert result == match(lookup_value, lookup_row, match_type)
+    assert result == match(lookup_value, lookup_col, match_type)
+
 
 @pytest.mark.parametrize(
     'lookup_array, lookup_value, result1, result0, resultm1', (
@@ -754,6 +829,11 @@ def test_match(lookup_value, lookup_array, match_type, result):
 )
 def test_match_crazy_order(
         lookup_array, lookup_value, result1, result0, resultm1):
+    lookup_vector = LookupVector(lookup_array)
+    for match_type in (1, 0, -1):
+        assert _match(lookup_value, lookup_array, match_type) == _match(
+            lookup_value, lookup_vector, match_type)
+
     assert result0 == _match(lookup_value, lookup_array, 0)
     assert resultm1 == _match(lookup_value, lookup_array, -1)
     if result1 != _match(lookup_value, lookup_array, 1):
@@ -994,6 +1074,29 @@ class TestSumIfs:
                            ((1, 2, 3, 4, 5), ), ">=3",
                            ((1, 2, 3, 4, 5), ), "<=4")
 
+    def test_mixed_types(self):
+        result = sumifs(((1, '2', True, 4.5, NA_ERROR), ),
+                        (('a', 'ab', 'b', 'Ac', 'x'), ), "a*")
+        assert 5.5 == result
+        assert isinstance(result, float)
+
+        result = sumifs(((1, '2', True, 4, NA_ERROR), ),
+                        (('a', 'ab', 'a', 'x', 'x'), ), "a*")
+        assert 2 == result
+        assert isinstance(result, int)
+
+    def test_error_in_sum_range(self):
+        assert NA_ERROR == sumifs(((1, DIV0, NA_ERROR), ),
+                                  ((1, 2, 3), ), ">2")
+        assert 1 == sumifs(((1, DIV0, NA_ERROR), ), ((1, 2, 3), ), "<2")
+
+    def test_range_values(self):
+        sum_range = RangeValues(((100, 123, 12, 23, 633), ))
+        rng = RangeValues(((1, 2, 3, 4, 5), ))
+        assert 668 == sumifs(sum_range, rng, ">=3")
+        assert '_typed_view' in rng.__dict__
+        assert 668 == sumifs(sum_range, rng, ">=3")
+
 
 @pytest.mark.parametrize(
     'args, result', (
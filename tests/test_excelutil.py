@@ -9,8 +9,11 @@ from pycel.excelutil import (
     AddressRange,
     assert_list_like,
     build_operator_operand_fixup,
+    build_wildcard_re,
     coerce_to_number,
     coerce_to_string,
+    criteria_cache_info,
+    criteria_mask_builder,
     criteria_parser,
     date_from_int,
     EMPTY,
@@ -22,7 +25,9 @@ from pycel.excelutil import (
     in_array_formula_context,
     is_leap_year,
     is_number,
+    LazyRange,
     list_like,
+    LookupVector,
     MAX_COL,
     MAX_ROW,
     NUM_ERROR,
@@ -30,8 +35,10 @@ from pycel.excelutil import (
     OPERATORS,
     PyCelException,
     range_boundaries,
+    RangeValues,
     split_sheetname,
     structured_reference_boundaries,
+    TypedRangeView,
     uniqueify,
     unquote_sheetname,
     VALUE_ERROR,
@@ -785,6 +792,9 @@ def test_find_corresponding_index():
     with pytest.raises(ValueError):
         find_corresponding_index((list('ABB'), ), None)
 
+    with pytest.raises(ValueError):
+        criteria_mask_builder(None)
+
 
 @pytest.mark.parametrize(
     'value, expected', (
@@ -901,6 +911,43 @@ def test_list_like(value, expected):
 def test_criteria_parser(value, criteria, expected):
     assert expected == criteria_parser(criteria)(value)
 
+    view = TypedRangeView.create(((value, ), ))
+    assert expected == criteria_mask_builder(criteria)(view)[0][0]
+
+
+def test_criteria_cache():
+    assert criteria_parser('<>xyzzy') is criteria_parser('<>xyzzy')
+    assert criteria_parser(1) is not criteria_parser(1.0)
+    assert build_wildcard_re('xy*zy') is build_wildcard_re('xy*zy')
+
+    before = criteria_cache_info()
+    assert set(before) == {
+        'criteria_parser', 'criteria_mask_builder', 'build_wildcard_re'}
+    criteria_mask_builder('>plugh')
+    criteria_mask_builder('>plugh')
+    after = criteria_cache_info()['criteria_mask_builder']
+    assert after['hits'] == before['criteria_mask_builder']['hits'] + 1
+    assert after['misses'] == before['criteria_mask_builder']['misses'] + 1
+    assert 0 < after['hit_rate'] < 1
+
+
+def test_typed_range_view():
+    view = TypedRangeView.create(((1, '2', 'Ab'), (None, True, DIV0)))
+    assert view.values.shape == (2, 3)
+    assert view.is_str.tolist() == [[False, True, True], [False, False, True]]
+    assert view.lower.tolist() == [['', '2', 'ab'], ['', '', '#div/0!']]
+    assert view.number[0].tolist()[:2] == [1.0, 2.0]
+    assert view.real[1].tolist()[1] == 1.0
+    assert view.is_int.tolist() == [[True, False, False], [False, True, False]]
+    assert view.is_error.tolist() == [
+        [False, False, False], [False, False, True]]
+
+    values = RangeValues(((1, 2), (3, 4)))
+    assert TypedRangeView.create(values) is values.typed_view
+
+    with pytest.raises(TypeError):
+        TypedRangeView.create('ABB')
+
 
 @pytest.mark.parametrize(
     'lval, op, rval, result', (
@@ -1191,3 +1238,63 @@ def test_excel_operator_operand_fixup(left_op, op, right_op, expected):
     elif expected == DIV0 and DIV0 not in (left_op, right_op):
         assert [(True, 'Values: {} {} {}'.format(left_op, op, right_op))
                 ] == error_messages
+
+
+def test_lazy_range():
+    accessed = []
+
+    def get_value(row, col):
+        accessed.append((row, col))
+        return row * 10 + col
+
+    lazy = LazyRange(AddressRange('A1:C4').size, get_value)
+    assert len(lazy) == 4
+    assert accessed == []
+
+    assert lazy[1][2] == 12
+    assert lazy[-1][0] == 30
+    assert accessed == [(1, 2), (3, 0)]
+
+    assert len(lazy.column(1)) == 4
+    assert lazy.column(1)[1:3] == (11, 21)
+    assert tuple(lazy.row(2)) == (20, 21, 22)
+    assert tuple(tuple(row) for row in lazy[2:]) == (
+        (20, 21, 22), (30, 31, 32))
+
+    with pytest.raises(IndexError):
+        lazy.row(0)[3]
+    with pytest.raises(IndexError):
+        lazy[4]
+
+
+def test_range_values_lookup_vectors():
+    values = RangeValues((
+        (1, 'A', NUM_ERROR), (2.0, 'b', None), (1, 'a', True)))
+    assert values == ((1, 'A', NUM_ERROR), (2.0, 'b', None), (1, 'a', True))
+
+    assert values.column(0) == (1, 2.0, 1)
+    assert values.column(-1) is values.column(2)
+    assert values.row(-1) is values.row(2)
+    assert isinstance(values.row(1), LookupVector)
+
+    assert values.column(0).index == {(0, 1): 1, (0, 2): 2}
+    assert values.column(1).index == {(1, 'a'): 1, (1, 'b'): 2}
+    assert values.column(2).index == {(0, 0.0): 2, (2, True): 3}
+    assert values.row(1).index == {(0, 2): 1, (1, 'b'): 2, (0, 0): 3}
+
+    unpickled = pickle.loads(pickle.dumps(values))
+    assert unpickled == values
+    assert isinstance(unpickled, RangeValues)
+    assert '_vectors' not in unpickled.__dict__
+
+
+def test_lookup_vector_sort_keys():
+    vector = LookupVector((1, 'a', None, 3, True, 'c'))
+    keys, last_of_type = vector.sort_keys(ExcelCmp(2))
+    assert keys == ((0, 1), (1, 'a'), (0, 0.0), (0, 3), (2, True), (1, 'c'))
+    assert last_of_type == (1, 1, 3, 4, 4, 4)
+    assert vector.sort_keys(ExcelCmp(2)) is vector.sort_keys(ExcelCmp(5))
+
+    keys, last_of_type = vector.sort_keys(ExcelCmp('b'))
+    assert keys[2] == (1, '')
+    assert last_of_type == (0, 2, 2, 2, 2, 6)
@@ -1,10 +1,33 @@
+import io
+import zipfile
+from unittest import mock
+
 import pytest
 
-from pycel.excelutil import AddressRange
-from pycel.excelwrapper import ARRAY_FORMULA_FORMAT, _OpxRange
+from openpyxl.utils import get_column_letter
+from openpyxl.xml.constants import SHEET_MAIN_NS
+from pycel import excelwrapper
+from pycel.excelutil import AddressCell, AddressRange
+from pycel.excelwrapper import (
+    _OpxRange,
+    ARRAY_FORMULA_FORMAT,
+    ExcelOpxWrapper,
+    ExcelXlsxWrapper,
+)
 from test_excelutil import ATestCell
 
 
+@pytest.fixture(params=('opx', 'xlsx', 'xlsx_lazy_sheets'))
+def excel(request, unconnected_excel, fixture_xls_path):
+    if request.param == 'opx':
+        excel = unconnected_excel
+    else:
+        excel = ExcelXlsxWrapper(
+            fixture_xls_path, lazy_sheets=request.param.endswith('sheets'))
+    excel.connect()
+    return excel
+
+
 def test_connect(unconnected_excel):
     try:
         unconnected_excel.connect()
@@ -214,6 +237,146 @@ def test_get_entire_rows_columns(excel, result_range, expected_range):
     assert result == expected
 
 
+def test_opx_cached_values(unconnected_excel):
+    unconnected_excel.connect()
+    assert list(unconnected_excel.cached_values) == [
+        ws.title for ws in unconnected_excel.workbook]
+
+    cached_values = unconnected_excel.cached_values['Sheet1']
+    assert cached_values.value_cell(2, 3).value == \
+        unconnected_excel.get_range('Sheet1!C2').values
+    assert cached_values.value_cell(600, 3).value is None
+
+    # get_range reads the index, and no longer patches openpyxl per call
+    with mock.patch('openpyxl.worksheet._reader.from_excel',
+                    side_effect=AssertionError):
+        values = unconnected_excel.get_range('Sheet1!A2:C2').values
+    assert values == (tuple(
+        cached_values.value_cell(2, col).value for col in range(1, 4)), )
+
+
+def test_xlsx_wrapper_matches_opx_wrapper(unconnected_excel, fixture_xls_path):
+    unconnected_excel.connect()
+    xlsx_excel = ExcelXlsxWrapper(fixture_xls_path)
+    xlsx_excel.connect()
+
+    sheets = [ws.title for ws in unconnected_excel.workbook]
+    assert sheets == [ws.title for ws in xlsx_excel.workbook]
+    assert (unconnected_excel.get_active_sheet_name() ==
+            xlsx_excel.get_active_sheet_name())
+
+    for sheet in sheets:
+        values = unconnected_excel.cached_values[sheet]
+        address = "'{}'!A1:{}{}".format(
+            sheet, get_column_letter(values.max_column + 1),
+            values.max_row + 1)
+        assert (unconnected_excel.get_range(address) ==
+                xlsx_excel.get_range(address))
+        assert (unconnected_excel.get_formula_or_value(address) ==
+                xlsx_excel.get_formula_or_value(address))
+
+
+def test_get_shared_formula(excel):
+    shared = excel.get_shared_formula(AddressCell('Sheet1!B3'))
+    if isinstance(excel, ExcelXlsxWrapper):
+        assert shared == (AddressCell('Sheet1!B1'), '=SUM(A1:A3)')
+    else:
+        assert shared is None
+    assert excel.get_shared_formula(AddressCell('Sheet1!A1')) is None
+
+
+def test_get_calc_chain(excel):
+    calc_chain = excel.get_calc_chain()
+    assert calc_chain[0] == AddressCell('ArrayForm!A32')
+    assert AddressCell('Sheet1!D1') in calc_chain
+    assert excel.get_calc_chain() is calc_chain
+
+    # no calc chain, and cells before a sheet id is given
+    assert list(excel._read_calc_chain(None, {}, {})) == []
+    archive = zipfile.ZipFile(io.BytesIO(), 'w')
+    archive.writestr('calcChain.xml', (
+        '<calcChain xmlns="{}"><c r="A1"/><c r="A2" i="2"/><c r="A3"/>'
+        '</calcChain>').format(SHEET_MAIN_NS))
+    rels = {'rId1': (excel.CALC_CHAIN_REL_TYPE, 'calcChain.xml')}
+    assert list(excel._read_calc_chain(archive, rels, {'2': 's'})) == [
+        AddressCell('s!A2'), AddressCell('s!A3')]
+
+
+@pytest.mark.parametrize('wrapper, kwargs', (
+    (ExcelOpxWrapper, {}),
+    (ExcelXlsxWrapper, {}),
+    (ExcelXlsxWrapper, dict(lazy_sheets=True)),
+    (ExcelXlsxWrapper, dict(parse_workers=2)),
+))
+def test_connect_from_memory(wrapper, kwargs, fixture_xls_path):
+    excel = wrapper(fixture_xls_path)
+    excel.connect()
+    address = 'Sheet1!A1:D18'
+    expected = excel.get_range(address)
+
+    with open(fixture_xls_path, 'rb') as f:
+        contents = f.read()
+        f.seek(0)
+        from_file_object = wrapper(f, **kwargs)
+    assert from_file_object.filename == fixture_xls_path
+
+    for excel in (wrapper(contents, **kwargs),
+                  wrapper(io.BytesIO(contents), **kwargs),
+                  from_file_object):
+        assert excel.contents == contents
+        excel.connect()
+        assert excel.get_range(address) == expected
+    assert excel.source.read() == contents
+
+
+def test_xlsx_wrapper_lazy_sheets(fixture_xls_path):
+    eager_excel = ExcelXlsxWrapper(fixture_xls_path)
+    eager_excel.connect()
+    excel = ExcelXlsxWrapper(fixture_xls_path, lazy_sheets=True)
+    excel.connect()
+    assert not any(ws.is_loaded for ws in excel.workbook)
+
+    # sheet index, defined names and tables are available without parsing
+    assert (excel.get_active_sheet_name() ==
+            eager_excel.get_active_sheet_name())
+    assert excel.defined_names == eager_excel.defined_names
+    assert excel.table('Table1').sheet_name == 'sref'
+    assert not any(ws.is_loaded for ws in excel.workbook)
+
+    excel.get_range('Sheet2!A1:B2')
+    assert [ws.title for ws in excel.workbook if ws.is_loaded] == ['Sheet2']
+
+    for ws in excel.workbook:
+        address = "'{}'!A1:Z30".format(ws.title)
+        assert excel.get_range(address) == eager_excel.get_range(address)
+    assert all(ws.is_loaded for ws in excel.workbook)
+
+
+def test_xlsx_wrapper_parse_workers(fixture_xls_path):
+    eager_excel = ExcelXlsxWrapper(fixture_xls_path)
+    eager_excel.connect()
+    excel = ExcelXlsxWrapper(fixture_xls_path, parse_workers=2)
+    excel.connect()
+
+    assert ([ws.title for ws in excel.workbook] ==
+            [ws.title for ws in eager_excel.workbook])
+    assert excel.table('Table1').sheet_name == 'sref'
+    for ws in excel.workbook:
+        assert ws.is_loaded
+        address = "'{}'!A1:Z30".format(ws.title)
+        assert excel.get_range(address) == eager_excel.get_range(address)
+        assert (list(map(len, ws.iter_rows())) ==
+                list(map(len, eager_excel.workbook[ws.title].iter_rows())))
+
+    # the worker, in process
+    sheet = excelwrapper._parse_worksheet_in_worker(
+        excel.filename, 'xl/sharedStrings.xml', 'xl/worksheets/sheet1.xml',
+        'Sheet1')
+    assert sheet.values == eager_excel.workbook['Sheet1'].values
+    assert sheet.formulas == eager_excel.workbook['Sheet1'].formulas
+    assert excelwrapper._read_shared_strings(None, None) == []
+
+
 @pytest.mark.parametrize(
     'value, formula',
     (